@@ -0,0 +1,118 @@
+# benchmarks/load_csv.py
+"""
+Streaming diet CSV loader (loader.py) on a synthetic food database.
+
+Offline (default): writes an N-row CSV (default 1M) to a temp dir and measures
+parse + normalize throughput and peak Python memory of the streaming pass
+against reading every row into a list first (what the loader used to do).
+With --mongo: also loads it into a scratch database (<MONGO_DBNAME>_bench,
+dropped afterwards) - full load, a --diff re-run with no changes and one
+with 1% of the EFs changed - and times the old one-update_one-per-row write
+on a sample to extrapolate.
+
+Run from the api folder:
+    python -m diet_co2.benchmarks.load_csv [--rows 1000000] [--mongo]
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from diet_co2 import loader
+from diet_co2.db import DB_NAME, get_client
+
+
+def write_csv(path: str, rows: int, seed: int = 0, changed_share: float = 0.0):
+    """Synthetic food table; changed_share of the rows get a different EF (same seed -> same names)."""
+    rnd = random.Random(seed)
+    flip = random.Random(seed + 1)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["food_type", "co2 _per_kg", "category"])
+        for i in range(rows):
+            ef = round(rnd.uniform(0.1, 100.0), 2)
+            if changed_share and flip.random() < changed_share:
+                ef = round(ef + 1.0, 2)
+            w.writerow([f"Food {i:07d} ({rnd.choice('ABCDEFGH')})", ef, rnd.choice(["grain", "meat", "veg", "dairy"])])
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return n, elapsed, peak
+
+def parse_streaming(path: str) -> int:
+    n = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        headers = reader.fieldnames or []
+        sample = list(itertools.islice(reader, loader.SNIFF_ROWS))
+        food_col, ef_col = loader.detect_columns(headers, sample)
+        for chunk in loader._chunked(itertools.chain(sample, reader), loader.LOADER_CHUNK):
+            n += sum(1 for r in chunk if loader.normalize_row(r, headers, food_col, ef_col))
+    return n
+
+def parse_list(path: str) -> int:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        headers = reader.fieldnames or []
+        raw_rows = [row for row in reader]
+    food_col, ef_col = loader.detect_columns(headers, raw_rows[:loader.SNIFF_ROWS])
+    normalized = [loader.normalize_row(r, headers, food_col, ef_col) for r in raw_rows]
+    return sum(1 for d in normalized if d)
+
+def offline(path: str, rows: int):
+    print(f"{'parse':<12}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'peak MB':>10}")
+    for name, fn in (("streaming", parse_streaming), ("list", parse_list)):
+        n, elapsed, peak = _measure(lambda: fn(path))
+        assert n == rows, (name, n)
+        print(f"{name:<12}{n:>10}{elapsed:>10.2f}{n / elapsed:>12.0f}{peak / 2**20:>10.1f}")
+
+async def online(path: str, changed_path: str, rows: int, sample: int):
+    bench_db = get_client()[f"{DB_NAME}_bench"]
+    loader.db = bench_db
+    await bench_db[loader.NORMALIZED_COLLECTION].drop()
+    await bench_db[loader.RAW_COLLECTION].drop()
+    try:
+        for label, csv_path, diff in (("full load", path, False), ("diff, no changes", path, True),
+                                      ("diff, 1% changed", changed_path, True)):
+            r = await loader.load_csv_into_mongo(csv_path, diff=diff)
+            print(f"{label:<18} {r['elapsed_s']:>8.2f}s  upserted={r['upserted']} modified={r['modified']} unchanged={r['unchanged']}")
+
+        # old write path: one awaited update_one per row
+        coll = bench_db["bench_row_by_row"]
+        await coll.create_index("food_name_normalized", unique=True)
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            headers = reader.fieldnames or []
+            docs = [loader.normalize_row(r, headers, "food_type", "co2 _per_kg") for r in itertools.islice(reader, sample)]
+        start = time.perf_counter()
+        for doc in docs:
+            await coll.update_one({"food_name_normalized": doc["food_name_normalized"]}, {"$set": doc}, upsert=True)
+        per_row = (time.perf_counter() - start) / len(docs)
+        print(f"{'row-by-row (est.)':<18} {per_row * rows:>8.2f}s  ({sample} rows timed, {per_row * 1e3:.3f} ms/row)")
+    finally:
+        await get_client().drop_database(f"{DB_NAME}_bench")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--mongo", action="store_true", help="also load into a scratch database on MONGO_URI")
+    parser.add_argument("--sample", type=int, default=10_000, help="rows timed for the row-by-row estimate")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "foods.csv")
+        write_csv(path, args.rows)
+        offline(path, args.rows)
+        if args.mongo:
+            changed = os.path.join(tmp, "foods_changed.csv")
+            write_csv(changed, args.rows, changed_share=0.01)
+            asyncio.run(online(path, changed, args.rows, args.sample))
@@ -1,7 +1,9 @@
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+
 from dotenv import load_dotenv
 
+from python_vin_co2.src.mongo_pool import MongoPool
+
 # Load .env specifically from this folder
 env_path = os.path.join(os.path.dirname(__file__), ".env")
 load_dotenv(env_path)
@@ -9,5 +11,26 @@ load_dotenv(env_path)
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGO_DBNAME", "food_emissions_db")
 
-_client = AsyncIOMotorClient(MONGO_URI)
-db = _client[DB_NAME]
+# Client, pool settings and pool metrics: one implementation shared with the
+# VIN/GPS service (python_vin_co2/src/mongo_pool.py). Created on first use.
+pool = MongoPool(MONGO_URI, DB_NAME)
+pool_stats = pool.stats
+get_client = pool.get_client
+get_db = pool.get_db
+warm_pool = pool.warm_pool
+close_client = pool.close
+db = pool.db
+
+# (collection, keys, options) per hot query; create_index is a no-op when the
+# index already exists, so this runs on every startup
+INDEXES = [
+    ("food_efs", [("food_name_normalized", 1)], {"unique": True}),
+    # /diet/summary range scans
+    ("consumption_logs", [("user_id", 1), ("ate_at", 1)], {"name": "user_ate_at"}),
+    # one rollup per user, day and food (diet_co2/rollups.py)
+    ("diet_daily_rollups", [("user_id", 1), ("date", 1), ("food", 1)], {"name": "user_date_food", "unique": True}),
+]
+
+async def ensure_indexes():
+    for coll, keys, options in INDEXES:
+        await db[coll].create_index(keys, **options)
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+import os
+import re
+from difflib import SequenceMatcher
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+from .db import db
+
+FOOD_COLLECTION = "food_efs"
+# seconds between reloads of food_efs (0 disables the refresh task)
+FOOD_INDEX_REFRESH_S = float(os.getenv("FOOD_INDEX_REFRESH_S", "60"))
+# minimum similarity (0-1) for an edit-distance match, e.g. 'Tomatos' -> 'Tomatoes'
+FOOD_FUZZY_CUTOFF = float(os.getenv("FOOD_FUZZY_CUTOFF", "0.85"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize_name(n: str) -> str:
+    return n.strip().lower()
+
+def _stem(token: str) -> str:
+    """Crude singular form so 'eggs'/'egg' and 'berries'/'berry' compare equal."""
+    if len(token) > 3 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith(("oes", "ches", "shes", "xes")):
+        return token[:-2]
+    if len(token) > 2 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def _stems(name: str) -> frozenset:
+    return frozenset(_stem(t) for t in _TOKEN_RE.findall(name))
+
+
+class EfIndex:
+    """
+    Immutable lookup structure over the food_efs rows. lookup() tries, in order:
+
+        exact       normalized name
+        prefix      trie walk; the earliest row (table order) starting with the query
+        substring   earliest row containing the query (what the old $regex fallback did,
+                    but literal, so '(' or '+' in user input are just characters)
+        tokens      every word of the query (singularized) appears in the name;
+                    fewest extra words wins
+        edit        closest name by SequenceMatcher ratio, if >= FOOD_FUZZY_CUTOFF
+
+    Rows are read-only mappings; a reload builds a new index and swaps it in.
+    """
+
+    def __init__(self, docs: List[dict]):
+        rows = []
+        exact: Dict[str, Mapping] = {}
+        trie: dict = {}
+        for doc in docs:
+            norm = doc.get("food_name_normalized")
+            if not norm:
+                continue
+            row = MappingProxyType(dict(doc))
+            rows.append(row)
+            exact.setdefault(norm, row)
+            # each trie node keeps the first row (table order) below it under ""
+            node = trie
+            for ch in norm:
+                node = node.setdefault(ch, {})
+                node.setdefault("", row)
+        self.rows = tuple(rows)
+        self._exact = MappingProxyType(exact)
+        self._trie = trie
+        self._stems = tuple((_stems(r["food_name_normalized"]), r) for r in rows)
+        self.digest = _digest(docs)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, food_name: str) -> Optional[Mapping]:
+        norm = normalize_name(food_name)
+        if not norm:
+            return None
+        return (self._exact.get(norm) or self._prefix(norm) or self._substring(norm)
+                or self._tokens(norm) or self._edit(norm))
+
+    def _prefix(self, norm: str) -> Optional[Mapping]:
+        node = self._trie
+        for ch in norm:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node.get("")
+
+    def _substring(self, norm: str) -> Optional[Mapping]:
+        return next((r for r in self.rows if norm in r["food_name_normalized"]), None)
+
+    def _tokens(self, norm: str) -> Optional[Mapping]:
+        query = _stems(norm)
+        if not query:
+            return None
+        best, best_extra = None, None
+        for stems, row in self._stems:
+            if query <= stems:
+                extra = len(stems - query)
+                if best is None or extra < best_extra:
+                    best, best_extra = row, extra
+        return best
+
+    def _edit(self, norm: str) -> Optional[Mapping]:
+        best, best_ratio = None, FOOD_FUZZY_CUTOFF
+        for row in self.rows:
+            ratio = SequenceMatcher(None, norm, row["food_name_normalized"]).ratio()
+            if ratio >= best_ratio and (best is None or ratio > best_ratio):
+                best, best_ratio = row, ratio
+        return best
+
+
+def _digest(docs: List[dict]) -> str:
+    h = hashlib.sha1()
+    for d in docs:
+        h.update(f"{d.get('food_name_normalized')}\x1f{d.get('food_name')}\x1f{d.get('kgco2e_per_kg')}\x1e".encode())
+    return h.hexdigest()[:12]
+
+
+_index: Optional[EfIndex] = None
+
+def current() -> Optional[EfIndex]:
+    """The loaded index, or None until the first successful load."""
+    return _index
+
+async def reload_index() -> bool:
+    """Re-read food_efs and swap the index in if the rows changed. Returns True on a swap."""
+    global _index
+    projection = {"_id": 0, "food_name": 1, "food_name_normalized": 1, "kgco2e_per_kg": 1}
+    docs = await db[FOOD_COLLECTION].find({}, projection).sort("_id", 1).to_list(length=None)
+    if _index is not None and _index.digest == _digest(docs):
+        return False
+    _index = EfIndex(docs)
+    return True
+
+async def watch_index(interval: float = FOOD_INDEX_REFRESH_S):
+    """Background task: reload food_efs every `interval` seconds; errors keep the old index."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await reload_index():
+                print(f"food_efs index reloaded ({len(_index)} rows)")
+        except Exception as e:
+            print("Warning: food_efs index reload failed:", repr(e))
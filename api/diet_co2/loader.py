@@ -1,8 +1,13 @@
+import argparse
 import csv
+import itertools
 import os
+import time
 from datetime import datetime
 import asyncio
+from typing import Dict, Iterator, List, Optional
 from dotenv import load_dotenv
+from pymongo import UpdateOne
 
 # load .env (tries package .env then project root)
 env_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -15,10 +20,15 @@ from .db import db
 CSV_PATH = os.getenv("FOOD_CSV_PATH", "data/Food_type_co2.csv")
 FOOD_NAME_COL_OVERRIDE = os.getenv("FOOD_NAME_COL")
 EF_COL_OVERRIDE = os.getenv("EF_COL")
+# rows per bulk_write / insert_many round-trip
+LOADER_CHUNK = int(os.getenv("FOOD_LOADER_CHUNK", "1000"))
 
 NORMALIZED_COLLECTION = "food_efs"
 RAW_COLLECTION = "food_efs_raw"
 
+# rows looked at when guessing the food / EF columns
+SNIFF_ROWS = 10
+
 def normalize_food_name(name: str) -> str:
     return name.strip().lower()
 
@@ -29,24 +39,8 @@ def is_number(s: str):
     except Exception:
         return False
 
-async def load_csv_into_mongo(csv_path: str = CSV_PATH):
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"CSV file not found at {csv_path}")
-
-    # Read CSV
-    with open(csv_path, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        headers = reader.fieldnames or []
-        raw_rows = [row for row in reader]
-
-    # ---------- Insert raw rows AS-IS (no added metadata) ----------
-    # Clear and reinsert raw rows exactly (preserves Excel headers)
-    await db[RAW_COLLECTION].delete_many({})
-    if raw_rows:
-        # Insert raw rows exactly; Mongo will add its own ObjectId but we won't add extra fields
-        await db[RAW_COLLECTION].insert_many(raw_rows)
-
-    # ---------- Detect columns (same logic as before) ----------
+def detect_columns(headers: List[str], sample_rows: List[dict]):
+    """(food_col, ef_col) from overrides, known header names, then the first rows' values."""
     food_col = None
     ef_col = None
 
@@ -69,8 +63,8 @@ async def load_csv_into_mongo(csv_path: str = CSV_PATH):
                 ef_col = c
                 break
 
-    if (not food_col or not ef_col) and raw_rows:
-        first = raw_rows[0]
+    if (not food_col or not ef_col) and sample_rows:
+        first = sample_rows[0]
         if not food_col:
             for h in headers:
                 v = first.get(h)
@@ -80,7 +74,7 @@ async def load_csv_into_mongo(csv_path: str = CSV_PATH):
         if not ef_col:
             for h in headers:
                 numeric_found = False
-                for rr in raw_rows[:10]:
+                for rr in sample_rows[:SNIFF_ROWS]:
                     v = rr.get(h)
                     if v is None:
                         continue
@@ -91,67 +85,144 @@ async def load_csv_into_mongo(csv_path: str = CSV_PATH):
                 if numeric_found:
                     ef_col = h
                     break
-
-    # ---------- Build minimal normalized docs ----------
-    normalized = []
-    for r in raw_rows:
-        # get food name
-        raw_food_name = None
-        if food_col and food_col in r:
-            raw_food_name = r.get(food_col)
-        else:
-            for h in headers:
-                v = r.get(h)
-                if v and str(v).strip() != "":
-                    raw_food_name = v
-                    break
-        if not raw_food_name:
-            continue
-
-        # get ef
-        ef_val = None
-        if ef_col and ef_col in r:
-            s = r.get(ef_col)
-            if s is not None and str(s).strip() != "":
+    return food_col, ef_col
+
+def normalize_row(r: dict, headers: List[str], food_col: Optional[str], ef_col: Optional[str]) -> Optional[dict]:
+    """Minimal food_efs doc for one CSV row, or None when the row has no food name."""
+    # get food name
+    raw_food_name = None
+    if food_col and food_col in r:
+        raw_food_name = r.get(food_col)
+    else:
+        for h in headers:
+            v = r.get(h)
+            if v and str(v).strip() != "":
+                raw_food_name = v
+                break
+    if not raw_food_name:
+        return None
+
+    # get ef
+    ef_val = None
+    if ef_col and ef_col in r:
+        s = r.get(ef_col)
+        if s is not None and str(s).strip() != "":
+            try:
+                ef_val = float(str(s).strip())
+            except Exception:
+                ef_val = None
+    # try any numeric column if still None
+    if ef_val is None:
+        for h in headers:
+            v = r.get(h)
+            if v is None:
+                continue
+            s = str(v).strip()
+            if is_number(s):
                 try:
-                    ef_val = float(str(s).strip())
+                    ef_val = float(s)
+                    break
                 except Exception:
-                    ef_val = None
-        # try any numeric column if still None
-        if ef_val is None:
-            for h in headers:
-                v = r.get(h)
-                if v is None:
                     continue
-                s = str(v).strip()
-                if is_number(s):
-                    try:
-                        ef_val = float(s)
-                        break
-                    except Exception:
-                        continue
 
-        doc = {
-            "food_name": str(raw_food_name),
-            "food_name_normalized": normalize_food_name(str(raw_food_name)),
-            "kgco2e_per_kg": ef_val  # float or None
-        }
-        normalized.append(doc)
-
-    # ---------- Insert/update normalized docs ----------
-    # We'll use upsert matching on food_name_normalized; do not force _id
-    for doc in normalized:
-        await db[NORMALIZED_COLLECTION].update_one(
-            {"food_name_normalized": doc["food_name_normalized"]},
-            {"$set": doc},
-            upsert=True
+    return {
+        "food_name": str(raw_food_name),
+        "food_name_normalized": normalize_food_name(str(raw_food_name)),
+        "kgco2e_per_kg": ef_val  # float or None
+    }
+
+def _chunked(rows: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+async def _write_chunk(raw_rows: List[dict], docs: List[dict], diff: bool, stats: Dict[str, int]):
+    # within a chunk the last row for a name wins, as with row-by-row upserts
+    by_name = {d["food_name_normalized"]: d for d in docs}
+
+    if diff:
+        existing = db[NORMALIZED_COLLECTION].find(
+            {"food_name_normalized": {"$in": list(by_name)}},
+            {"_id": 0, "food_name": 1, "food_name_normalized": 1, "kgco2e_per_kg": 1}
         )
+        async for old in existing:
+            new = by_name.get(old["food_name_normalized"])
+            if new is not None and old.get("food_name") == new["food_name"] and old.get("kgco2e_per_kg") == new["kgco2e_per_kg"]:
+                del by_name[old["food_name_normalized"]]
+                stats["unchanged"] += 1
 
-    # create index on normalized name for fast lookup (idempotent)
+    if raw_rows:
+        await db[RAW_COLLECTION].insert_many(raw_rows, ordered=False)
+    if by_name:
+        ops = [UpdateOne({"food_name_normalized": name}, {"$set": doc}, upsert=True) for name, doc in by_name.items()]
+        result = await db[NORMALIZED_COLLECTION].bulk_write(ops, ordered=False)
+        stats["upserted"] += result.upserted_count
+        stats["modified"] += result.modified_count
+
+async def load_csv_into_mongo(csv_path: str = CSV_PATH, diff: bool = False, chunk_size: int = LOADER_CHUNK):
+    """
+    Stream the CSV into food_efs_raw (as-is) and food_efs (normalized, upserted
+    by food_name_normalized) in chunks of `chunk_size` rows. Parsing the next
+    chunk overlaps with writing the previous one.
+
+    diff=True only writes normalized rows that are new or whose name/EF
+    changed, and leaves food_efs_raw alone (raw rows have no key to compare).
+    A name repeated in different chunks is compared per chunk, so it may be
+    rewritten. Rows missing from the CSV are never deleted from food_efs.
+    """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"CSV file not found at {csv_path}")
+
+    started = time.perf_counter()
+    stats = {"upserted": 0, "modified": 0, "unchanged": 0}
+    raw_count = 0
+    normalized_count = 0
+
+    # unique index first: every upsert below matches on it
     await db[NORMALIZED_COLLECTION].create_index("food_name_normalized", unique=True)
+    if not diff:
+        # Clear and reinsert raw rows exactly (preserves Excel headers)
+        await db[RAW_COLLECTION].delete_many({})
 
-    return {"raw_count": len(raw_rows), "normalized_count": len(normalized), "detected_food_col": food_col, "detected_ef_col": ef_col}
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        headers = reader.fieldnames or []
+        # ---------- Detect columns once, from the first rows ----------
+        sample = list(itertools.islice(reader, SNIFF_ROWS))
+        food_col, ef_col = detect_columns(headers, sample)
+
+        pending = None
+        for chunk in _chunked(itertools.chain(sample, reader), chunk_size):
+            raw_count += len(chunk)
+            docs = [d for d in (normalize_row(r, headers, food_col, ef_col) for r in chunk) if d is not None]
+            normalized_count += len(docs)
+            # Mongo adds its own ObjectId to the raw rows but we don't add extra fields
+            raw_rows = [] if diff else chunk
+            if pending is not None:
+                await pending
+            pending = asyncio.create_task(_write_chunk(raw_rows, docs, diff, stats))
+            # let the task hand its first operation to Motor's thread pool before parsing on
+            await asyncio.sleep(0)
+        if pending is not None:
+            await pending
+
+    return {
+        "raw_count": raw_count,
+        "normalized_count": normalized_count,
+        "detected_food_col": food_col,
+        "detected_ef_col": ef_col,
+        "diff": diff,
+        **stats,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
 
 if __name__ == "__main__":
-    asyncio.run(load_csv_into_mongo())
+    parser = argparse.ArgumentParser(description="Load the food emission-factor CSV into MongoDB")
+    parser.add_argument("--csv", default=CSV_PATH, help="CSV path (default FOOD_CSV_PATH)")
+    parser.add_argument("--diff", action="store_true", help="only write new/changed normalized rows; keep food_efs_raw")
+    parser.add_argument("--chunk-size", type=int, default=LOADER_CHUNK)
+    args = parser.parse_args()
+    print(asyncio.run(load_csv_into_mongo(args.csv, diff=args.diff, chunk_size=args.chunk_size)))
     print("CSV loaded into MongoDB.")
@@ -1,29 +1,97 @@
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
-from typing import List
+from typing import Dict, List, Optional
 import asyncio
+import re
 from fastapi.encoders import jsonable_encoder
 
 
-from .db import db
+from .db import db, ensure_indexes, warm_pool, close_client, pool_stats
 from .models import FoodInput, ConsumptionRequest, ConsumptionResponse, ComputationResult
+from . import ef_index
+from .ef_index import FOOD_COLLECTION, normalize_name
+from . import rollups
+from .rollups import LOG_COLLECTION
+from .summary import router as summary_router
 
 app = FastAPI(title="Diet CO2 Service")
+app.include_router(summary_router)
+
+ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "1") != "0"
+
+_background_tasks = []
+
+@app.on_event("startup")
+async def startup_event():
+    try:
+        await warm_pool()
+    except Exception as e:
+        print("Warning: Mongo pool warm-up failed, connections will open on demand:", repr(e))
+    if ENSURE_INDEXES:
+        try:
+            await ensure_indexes()
+        except Exception as e:
+            print("Warning: ensure_indexes failed:", repr(e))
+    # food_efs is tiny: keep it in memory so meals resolve without DB reads
+    try:
+        await ef_index.reload_index()
+        print(f"food_efs index loaded ({len(ef_index.current())} rows)")
+    except Exception as e:
+        print("Warning: could not load food_efs index, falling back to per-item queries:", repr(e))
+    if ef_index.FOOD_INDEX_REFRESH_S > 0:
+        _background_tasks.append(asyncio.create_task(ef_index.watch_index()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    close_client()
+
+@app.get("/metrics")
+def metrics():
+    """In-process counters for this worker."""
+    index = ef_index.current()
+    return {
+        "mongo_pool": pool_stats.snapshot(),
+        "food_index": {"rows": len(index), "digest": index.digest} if index is not None else None
+    }
 
-FOOD_COLLECTION = "food_efs"
-LOG_COLLECTION = "consumption_logs"
-
-def normalize_name(n: str) -> str:
-    return n.strip().lower()
-
-async def lookup_ef(food_name: str):
-    # search by normalized field (we no longer store normalized name as _id)
-    norm = normalize_name(food_name)
-    doc = await db[FOOD_COLLECTION].find_one({"food_name_normalized": norm})
-    return doc
+async def lookup_efs(norms: List[str]) -> Dict[str, dict]:
+    """Exact matches for many normalized names in one $in query (first row per name, like find_one)."""
+    found: Dict[str, dict] = {}
+    async for doc in db[FOOD_COLLECTION].find({"food_name_normalized": {"$in": norms}}):
+        found.setdefault(doc["food_name_normalized"], doc)
+    return found
+
+async def lookup_ef_substring(norm: str) -> Optional[dict]:
+    # substring match (case-insensitive) - helpful for small differences like 'Eggs' vs 'Egg'
+    cursor = db[FOOD_COLLECTION].find({"food_name_normalized": {"$regex": re.escape(norm)}}).limit(1)
+    found = await cursor.to_list(length=1)
+    return found[0] if found else None
+
+async def resolve_efs(food_names: List[str]) -> List[Optional[dict]]:
+    """
+    EF row per food name (None when unknown): from the in-memory index when
+    loaded, else one $in query for exact names plus the substring fallback
+    for the misses, run concurrently.
+    """
+    index = ef_index.current()
+    if index is not None:
+        return [index.lookup(name) for name in food_names]
+
+    norms = [normalize_name(name) for name in food_names]
+    distinct = list(dict.fromkeys(norms))
+    by_norm = await lookup_efs(distinct)
+    misses = [n for n in distinct if n not in by_norm]
+    if misses:
+        fallbacks = await asyncio.gather(*(lookup_ef_substring(n) for n in misses))
+        by_norm.update(zip(misses, fallbacks))
+    return [by_norm.get(n) for n in norms]
 
 
 @app.post("/compute_food_co2", response_model=ConsumptionResponse)
@@ -34,21 +102,17 @@ async def compute_food_co2(req: ConsumptionRequest):
     user_id = req.user_id
 
     results: List[ComputationResult] = []
+    matched: List[str] = []   # food_efs name each item resolved to
     total_co2 = 0.0
 
     # Validate items list
     if not req.items or len(req.items) == 0:
         raise HTTPException(status_code=400, detail="No items provided")
 
-    for item in req.items:
-        # lookup EF
-        ef_doc = await lookup_ef(item.food_type)
-        if not ef_doc:
-            # If not found, we fallback to trying to match by substring or return error
-            # Try a substring match (case-insensitive) - helpful for small differences like 'Eggs' vs 'Egg'
-            cursor = db[FOOD_COLLECTION].find({"food_name_normalized": {"$regex": normalize_name(item.food_type)}}).limit(1)
-            found = await cursor.to_list(length=1)
-            ef_doc = found[0] if found else None
+    # resolve every item's EF up front (no per-item round-trips)
+    ef_docs = await resolve_efs([item.food_type for item in req.items])
+
+    for item, ef_doc in zip(req.items, ef_docs):
 
         if not ef_doc or ef_doc.get("kgco2e_per_kg") is None:
             # If EF missing, you can choose to:
@@ -69,17 +133,23 @@ async def compute_food_co2(req: ConsumptionRequest):
             co2_kg=co2
         )
         results.append(result)
+        matched.append(ef_doc.get("food_name") or item.food_type)
+
+    # stored as naive UTC, like created_at; summaries and rollups use its UTC day
+    ate_at_utc = ate_at.astimezone(timezone.utc).replace(tzinfo=None) if ate_at.tzinfo else ate_at
 
     # Build log doc (immutable)
     log_doc = {
         "session_id": session_id,
         "user_id": user_id,
-        "items": [r.dict() for r in results],
+        "items": [{**r.dict(), "food_name": food} for r, food in zip(results, matched)],
         "total_co2_kg": round(total_co2, 6),
+        "ate_at": ate_at_utc,
         "created_at": datetime.utcnow()
     }
 
     res = await db[LOG_COLLECTION].insert_one(log_doc)
+    await rollups.record_meal(user_id, ate_at_utc.date().isoformat(), log_doc["items"])
 
 
     response = ConsumptionResponse(
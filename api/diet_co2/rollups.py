@@ -0,0 +1,114 @@
+"""
+Per-day, per-food diet totals maintained at write time.
+
+One diet_daily_rollups document per (user_id, date, food):
+    co2_kg          - sum of the items' co2_kg
+    quantity_grams  - sum of the items' quantity
+    items           - number of logged items
+
+`date` is the UTC day of the meal's ate_at and `food` is the matched
+food_efs name. Dashboards read these few documents instead of scanning
+consumption_logs. Rebuild them from the logs with (from the api folder):
+    python -m diet_co2.rollups [--user USER_ID]
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Iterable, Optional
+
+from pymongo import UpdateOne
+
+from .db import db
+
+LOG_COLLECTION = "consumption_logs"
+ROLLUP_COLLECTION = "diet_daily_rollups"
+
+
+def _inc_op(user_id: str, day: str, food: str, co2_kg: float, quantity_grams: float, items: int = 1) -> UpdateOne:
+    return UpdateOne(
+        {"user_id": user_id, "date": day, "food": food},
+        {
+            "$inc": {"co2_kg": co2_kg, "quantity_grams": quantity_grams, "items": items},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        upsert=True
+    )
+
+def _set_op(user_id: str, day: str, food: str, co2_kg: float, quantity_grams: float, items: int, now: datetime) -> UpdateOne:
+    return UpdateOne(
+        {"user_id": user_id, "date": day, "food": food},
+        {"$set": {"co2_kg": co2_kg, "quantity_grams": quantity_grams, "items": items, "updated_at": now}},
+        upsert=True
+    )
+
+async def record_meal(user_id: Optional[str], day: str, items: Iterable[dict]):
+    """
+    Fold a logged meal's items (consumption_logs item dicts) into the rollups.
+    Anonymous meals are not rolled up. A failure is logged, not raised: the
+    log is already stored and the rollups can be rebuilt.
+    """
+    if not user_id:
+        return
+    ops = [
+        _inc_op(user_id, day, it.get("food_name") or it["food_type"], float(it["co2_kg"]), float(it["quantity_grams"]))
+        for it in items
+    ]
+    if not ops:
+        return
+    try:
+        await db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False)
+    except Exception as e:
+        print("Warning: failed to update diet rollups:", repr(e))
+
+async def rebuild(user_id: Optional[str] = None, batch_size: int = 1000) -> dict:
+    """
+    Recompute the rollups from consumption_logs (optionally for one user).
+    Logs written before ate_at was stored get ate_at = created_at first.
+
+    Totals are written with $set, and afterwards only rollups nobody touched
+    since the rebuild started are deleted, so it can run while meals are being
+    logged. A meal logged during the rebuild may still be off for its
+    day/food (its $inc and the $set can interleave); the next rebuild fixes it.
+    """
+    query = {"user_id": user_id} if user_id else {"user_id": {"$ne": None}}
+    started = datetime.utcnow()
+    # older logs have no ate_at: use created_at so /diet/summary finds them too
+    await db[LOG_COLLECTION].update_many({**query, "ate_at": {"$exists": False}}, [{"$set": {"ate_at": "$created_at"}}])
+
+    cursor = db[LOG_COLLECTION].aggregate([
+        {"$match": query},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$ate_at"}},
+                "food": {"$ifNull": ["$items.food_name", "$items.food_type"]},
+            },
+            "co2_kg": {"$sum": "$items.co2_kg"},
+            "quantity_grams": {"$sum": "$items.quantity_grams"},
+            "items": {"$sum": 1},
+        }},
+    ], allowDiskUse=True)
+
+    ops, written = [], 0
+    async for r in cursor:
+        k = r["_id"]
+        ops.append(_set_op(k["user_id"], k["date"], k["food"], float(r["co2_kg"]), float(r["quantity_grams"]),
+                           int(r["items"]), datetime.utcnow()))
+        if len(ops) >= batch_size:
+            await db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        await db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False)
+        written += len(ops)
+    # day/food totals that no longer have logs (neither rebuilt nor logged to since)
+    stale = await db[ROLLUP_COLLECTION].delete_many({**query, "updated_at": {"$lt": started}})
+    return {"rollups_written": written, "stale_deleted": stale.deleted_count}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild diet_daily_rollups from consumption_logs")
+    parser.add_argument("--user", help="only this user_id")
+    args = parser.parse_args()
+    print(asyncio.run(rebuild(user_id=args.user)))
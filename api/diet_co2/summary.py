@@ -0,0 +1,175 @@
+"""
+Diet footprint over a date range.
+
+/diet/summary aggregates consumption_logs directly: the {user_id, ate_at}
+index narrows the scan to the user's range and the pipeline returns one row
+per (day, food). /diet/daily reads the pre-summed diet_daily_rollups instead
+(a few documents per day) for dashboards. Days are UTC days of ate_at.
+"""
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from .db import db
+from .rollups import LOG_COLLECTION, ROLLUP_COLLECTION
+
+router = APIRouter(prefix="/diet", tags=["diet"])
+
+# longest range one summary may cover
+SUMMARY_MAX_DAYS = int(os.getenv("SUMMARY_MAX_DAYS", "1100"))
+GRANULARITIES = ("day", "week", "month")
+
+
+def _parse(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+
+def _range(user_id: str, from_: str, to: Optional[str]):
+    user_id = (user_id or "").strip()
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id required")
+    start = _parse(from_, "from")
+    end = _parse(to, "to") if to else datetime.utcnow().date()
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if (end - start).days + 1 > SUMMARY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"range too long (max {SUMMARY_MAX_DAYS} days)")
+    return user_id, start, end
+
+def period_bounds(day: date, granularity: str):
+    """(first, last) day of the period containing `day`; weeks start on Monday."""
+    if granularity == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if granularity == "month":
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    return day, day
+
+def _food_rows(foods: Dict[str, dict]):
+    rows = sorted(foods.values(), key=lambda f: -f["co2_kg"])
+    for f in rows:
+        f["co2_kg"] = round(f["co2_kg"], 6)
+        f["quantity_grams"] = round(f["quantity_grams"], 3)
+    return rows
+
+def _add_food(foods: Dict[str, dict], food: str, co2_kg: float, quantity_grams: float, items: int):
+    f = foods.setdefault(food, {"food": food, "co2_kg": 0.0, "quantity_grams": 0.0, "items": 0})
+    f["co2_kg"] += co2_kg
+    f["quantity_grams"] += quantity_grams
+    f["items"] += items
+
+
+@router.get("/summary")
+async def diet_summary(
+    user_id: str,
+    from_: str = Query(..., alias="from"),
+    to: Optional[str] = None,
+    granularity: str = "day",
+):
+    granularity = (granularity or "day").strip().lower()
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    user_id, start, end = _range(user_id, from_, to)
+
+    cursor = db[LOG_COLLECTION].aggregate([
+        {"$match": {"user_id": user_id, "ate_at": {
+            "$gte": datetime.combine(start, time.min),
+            "$lt": datetime.combine(end + timedelta(days=1), time.min)
+        }}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$ate_at"}},
+                "food": {"$ifNull": ["$items.food_name", "$items.food_type"]},
+            },
+            "co2_kg": {"$sum": "$items.co2_kg"},
+            "quantity_grams": {"$sum": "$items.quantity_grams"},
+            "items": {"$sum": 1},
+            "sessions": {"$addToSet": "$session_id"},
+        }},
+    ])
+
+    periods: Dict[date, dict] = {}
+    foods: Dict[str, dict] = {}
+    sessions: Dict[date, set] = {}   # meal (session) ids per period
+    all_sessions = set()
+    days = set()
+    total = 0.0
+    async for r in cursor:
+        day = date.fromisoformat(r["_id"]["day"])
+        food = r["_id"]["food"]
+        co2, grams, items = float(r["co2_kg"] or 0.0), float(r["quantity_grams"] or 0.0), int(r["items"])
+        first, last = period_bounds(day, granularity)
+        p = periods.setdefault(first, {
+            "period": first.isoformat() if granularity != "month" else first.strftime("%Y-%m"),
+            "start": max(first, start).isoformat(),
+            "end": min(last, end).isoformat(),
+            "co2_kg": 0.0,
+            "meals": 0,
+            "items": 0,
+            "foods": {}
+        })
+        p["co2_kg"] += co2
+        p["items"] += items
+        sessions.setdefault(first, set()).update(r["sessions"])
+        _add_food(p["foods"], food, co2, grams, items)
+        _add_food(foods, food, co2, grams, items)
+        all_sessions.update(r["sessions"])
+        days.add(day)
+        total += co2
+
+    rows = []
+    for k in sorted(periods):
+        p = periods[k]
+        p["co2_kg"] = round(p["co2_kg"], 6)
+        p["meals"] = len(sessions[k])
+        p["foods"] = _food_rows(p["foods"])
+        rows.append(p)
+
+    return {
+        "ok": True,
+        "user_id": user_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "total_co2_kg": round(total, 6),
+        "meals": len(all_sessions),
+        "days_with_data": len(days),
+        "foods": _food_rows(foods),
+        "periods": rows
+    }
+
+
+@router.get("/daily")
+async def diet_daily(user_id: str, from_: str = Query(..., alias="from"), to: Optional[str] = None):
+    """Per-day, per-food totals from diet_daily_rollups."""
+    user_id, start, end = _range(user_id, from_, to)
+    cursor = db[ROLLUP_COLLECTION].find(
+        {"user_id": user_id, "date": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+        {"_id": 0, "date": 1, "food": 1, "co2_kg": 1, "quantity_grams": 1, "items": 1}
+    ).sort([("date", 1), ("food", 1)])
+
+    days: Dict[str, dict] = {}
+    async for r in cursor:
+        d = days.setdefault(r["date"], {"date": r["date"], "co2_kg": 0.0, "foods": {}})
+        d["co2_kg"] += float(r.get("co2_kg") or 0.0)
+        _add_food(d["foods"], r["food"], float(r.get("co2_kg") or 0.0), float(r.get("quantity_grams") or 0.0), int(r.get("items") or 0))
+
+    rows = list(days.values())
+    for d in rows:
+        d["co2_kg"] = round(d["co2_kg"], 6)
+        d["foods"] = _food_rows(d["foods"])
+    return {
+        "ok": True,
+        "user_id": user_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "total_co2_kg": round(sum(d["co2_kg"] for d in rows), 6),
+        "days": rows
+    }
@@ -0,0 +1,75 @@
+# benchmarks/fanout.py
+"""
+Sequential vs. concurrent fan-out of /footprint/daily against fake upstreams
+(httpx.MockTransport, no network). Each source answers after a random delay
+around its median; the report shows P50/P99 of the whole call next to the
+slowest single source, then one run with the diet source stalled past its
+timeout to show the partial response.
+
+Run from the api folder:
+    python -m footprint_gateway.benchmarks.fanout [--requests 300]
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date
+
+import httpx
+
+from footprint_gateway import main as gateway
+
+# median upstream latency (s) per path
+MEDIANS = {"/reports/emissions": 0.030, "/diet/daily": 0.020, "/emissions-summary": 0.025}
+BODIES = {
+    "/reports/emissions": {"total_kg_co2": 3.2, "distance_km": 18.5, "days_with_data": 1},
+    "/diet/daily": {"total_co2_kg": 2.1, "days": [{"date": "2025-06-02", "foods": []}]},
+    "/emissions-summary": {"total": 300, "monthly": {"June 2025": 150}},
+}
+
+
+def fake_transport(rnd: random.Random, stall: str = ""):
+    async def handler(request: httpx.Request):
+        path = request.url.path
+        delay = 10.0 if path == stall else MEDIANS[path] * rnd.lognormvariate(0, 0.35)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json=BODIES[path])
+    return httpx.MockTransport(handler)
+
+async def sequential(user_id: str, day: str):
+    """What a client did before: one service after the other."""
+    target = date.fromisoformat(day)
+    return [await gateway._run_source(fn, user_id, target, timeout) for fn, timeout in gateway.sources().values()]
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def run(n: int):
+    gateway.ELECTRICITY_URL = "http://billing"
+    gateway.TRANSPORT_URL, gateway.DIET_URL = "http://transport", "http://diet"
+    gateway.set_client(httpx.AsyncClient(transport=fake_transport(random.Random(0))))
+
+    print(f"{'mode':<12}{'p50 ms':>9}{'p99 ms':>9}")
+    slowest = []
+    for label, call in (("sequential", sequential), ("gather", gateway.footprint_daily)):
+        times = []
+        for _ in range(n):
+            start = time.perf_counter()
+            out = await call("bench-user", "2025-06-02")
+            times.append((time.perf_counter() - start) * 1000)
+            if label == "gather":
+                slowest.append(max(s["elapsed_ms"] for s in out["sources"].values()))
+        print(f"{label:<12}{pct(times, 50):>9.1f}{pct(times, 99):>9.1f}")
+    print(f"{'slowest src':<12}{pct(slowest, 50):>9.1f}{pct(slowest, 99):>9.1f}")
+
+    gateway.set_client(httpx.AsyncClient(transport=fake_transport(random.Random(1), stall="/diet/daily")))
+    out = await gateway.footprint_daily("bench-user", "2025-06-02")
+    print(f"\ndiet stalled: elapsed {out['elapsed_ms']} ms, complete={out['complete']}, "
+          f"degraded={out['degraded']}, total_kg_co2={out['total_kg_co2']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests))
@@ -0,0 +1,192 @@
+"""
+Footprint gateway: one user-day across the Python services.
+
+GET /footprint/daily queries, concurrently,
+    transport    VIN/GPS service  /reports/emissions (emissions records), else
+                                  POST /calculate/daily for that day
+    diet         diet service     /diet/daily (diet_daily_rollups)
+    electricity  billing service  /emissions-summary (optional: set ELECTRICITY_URL)
+each with its own timeout, so the response takes about as long as the
+slowest source, not the sum. A source that fails or times out is reported
+under `sources` and left out of the total; the call only fails (502) when
+every per-user source does.
+
+Electricity is reported but never added to total_kg_co2: the billing
+service sums every user's bills by a free-form billing month, so it is not
+this user's footprint.
+
+Every source gets the same explicit day (default: today in UTC), but the
+upstreams bucket days differently: diet by the UTC day of ate_at, transport
+by each GPS ping's own calendar date in the offset the client sent. Around
+midnight the two can disagree for a user outside UTC. A transport record
+computed earlier in the day is not refreshed here; the daily batch or
+/calculate/daily recomputes it.
+
+Run from the api folder:
+    uvicorn footprint_gateway.main:app --port 8002
+"""
+import asyncio
+import calendar
+import os
+import re
+import time
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+TRANSPORT_URL = os.getenv("TRANSPORT_URL", "http://localhost:8000").rstrip("/")
+DIET_URL = os.getenv("DIET_URL", "http://localhost:8001").rstrip("/")
+ELECTRICITY_URL = (os.getenv("ELECTRICITY_URL") or "").rstrip("/")   # unset: no electricity source
+TRANSPORT_TIMEOUT_S = float(os.getenv("FOOTPRINT_TRANSPORT_TIMEOUT_S", "2"))
+DIET_TIMEOUT_S = float(os.getenv("FOOTPRINT_DIET_TIMEOUT_S", "2"))
+ELECTRICITY_TIMEOUT_S = float(os.getenv("FOOTPRINT_ELECTRICITY_TIMEOUT_S", "2"))
+
+# sources whose kg_co2 belongs to the user and is summed into total_kg_co2
+PER_USER_SOURCES = ("transport", "diet")
+
+app = FastAPI(title="Footprint Gateway")
+
+# one pooled keep-alive client for every upstream call (created on first use)
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    return _client
+
+def set_client(client: Optional[httpx.AsyncClient]):
+    """Swap the upstream client (e.g. one with a mock transport in benchmarks)."""
+    global _client
+    _client = client
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _get_json(url: str, params: dict, timeout: float) -> dict:
+    resp = await get_client().get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+async def transport_source(user_id: str, day: date, timeout: float) -> dict:
+    data = await _get_json(f"{TRANSPORT_URL}/reports/emissions",
+                           {"user_id": user_id, "from": day.isoformat(), "to": day.isoformat()}, timeout)
+    if data.get("days_with_data"):
+        return {
+            "kg_co2": float(data.get("total_kg_co2") or 0.0),
+            "distance_km": float(data.get("distance_km") or 0.0),
+            "has_data": True,
+        }
+    # no record yet (the daily batch has not run for the day): compute it from the pings
+    resp = await get_client().post(f"{TRANSPORT_URL}/calculate/daily",
+                                   params={"user_id": user_id, "day": day.isoformat()}, timeout=timeout)
+    if resp.status_code in (400, 404):
+        # no GPS distance, vehicle or country for the user-day: nothing to count
+        return {"kg_co2": 0.0, "distance_km": 0.0, "has_data": False}
+    resp.raise_for_status()
+    record = resp.json().get("record") or {}
+    return {
+        "kg_co2": float(record.get("total_kg_co2") or 0.0),
+        "distance_km": float(record.get("distance_km") or 0.0),
+        "has_data": True,
+        "computed": True,
+    }
+
+async def diet_source(user_id: str, day: date, timeout: float) -> dict:
+    data = await _get_json(f"{DIET_URL}/diet/daily",
+                           {"user_id": user_id, "from": day.isoformat(), "to": day.isoformat()}, timeout)
+    days = data.get("days") or []
+    return {
+        "kg_co2": float(data.get("total_co2_kg") or 0.0),
+        "foods": days[0].get("foods", []) if days else [],
+        "has_data": bool(days),
+    }
+
+def _is_billing_month(key: str, day: date) -> bool:
+    """True for billing-month keys naming day's month *and* year ('June 2025', 'Jun-2025', '2025-06', '06/2025')."""
+    key = key.strip().lower()
+    if str(day.year) not in key:
+        return False
+    words = re.findall(r"[a-z]+", key)
+    if calendar.month_name[day.month].lower() in words or calendar.month_abbr[day.month].lower() in words:
+        return True
+    numbers = [int(n) for n in re.findall(r"\d+", key) if n != str(day.year)]
+    return numbers == [day.month]
+
+async def electricity_source(user_id: str, day: date, timeout: float) -> dict:
+    # the billing service keeps monthly totals over every user's bills: report the
+    # day's share of the month for context only (see PER_USER_SOURCES)
+    data = await _get_json(f"{ELECTRICITY_URL}/emissions-summary", {}, timeout)
+    monthly = data.get("monthly") or {}
+    matched = [float(v) for k, v in monthly.items() if _is_billing_month(str(k), day)]
+    month_kg = sum(matched) if matched else None
+    days_in_month = calendar.monthrange(day.year, day.month)[1]
+    return {
+        "kg_co2": month_kg / days_in_month if month_kg is not None else 0.0,
+        "month_kg_co2": month_kg,
+        "scope": "all_users",
+        "has_data": month_kg is not None,
+    }
+
+async def _run_source(fn: Callable[..., Awaitable[dict]], user_id: str, day: date, timeout: float) -> dict:
+    """Run one source under its timeout; failures become {"ok": False, "error": ...}."""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(fn(user_id, day, timeout), timeout)
+        result = {"ok": True, **result}
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": f"timed out after {timeout}s"}
+    except httpx.HTTPStatusError as e:
+        result = {"ok": False, "error": f"upstream returned {e.response.status_code}"}
+    except Exception as e:
+        result = {"ok": False, "error": repr(e)}
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+def sources() -> Dict[str, tuple]:
+    """name -> (fetch function, timeout) for the configured sources."""
+    out = {
+        "transport": (transport_source, TRANSPORT_TIMEOUT_S),
+        "diet": (diet_source, DIET_TIMEOUT_S),
+    }
+    if ELECTRICITY_URL:
+        out["electricity"] = (electricity_source, ELECTRICITY_TIMEOUT_S)
+    return out
+
+
+@app.get("/footprint/daily")
+async def footprint_daily(user_id: str, day: Optional[str] = None):
+    user_id = (user_id or "").strip()
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id required")
+    try:
+        target = date.fromisoformat(day.strip()) if day else datetime.now(timezone.utc).date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+
+    configured = sources()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_run_source(fn, user_id, target, timeout) for fn, timeout in configured.values()))
+    by_source = dict(zip(configured, results))
+
+    ok = [name for name, r in by_source.items() if r["ok"]]
+    counted = [name for name in ok if name in PER_USER_SOURCES]
+    if not counted:
+        raise HTTPException(status_code=502, detail={"message": "all footprint sources failed", "sources": by_source})
+    return {
+        "ok": True,
+        "user_id": user_id,
+        "date": target.isoformat(),
+        "total_kg_co2": round(sum(by_source[name]["kg_co2"] for name in counted), 4),
+        "complete": len(ok) == len(by_source),
+        "degraded": [name for name in by_source if name not in ok],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "sources": by_source
+    }
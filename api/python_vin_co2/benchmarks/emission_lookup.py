@@ -0,0 +1,89 @@
+# benchmarks/emission_lookup.py
+"""
+Micro-benchmark: compiled EmissionIndex lookups vs the old per-call
+DataFrame boolean filters.
+
+Run from the python_vin_co2 folder (so DATA_DIR resolves):
+    python -m benchmarks.emission_lookup [iterations]
+"""
+import sys
+import time
+
+from src.services import emission
+
+
+# --- reference implementation: the per-call pandas filters the index replaced ---
+def df_lookup_grid_factor(country_code: str, subregion: str = ""):
+    df = emission.current_tables().grid_df
+    cc = (country_code or "").upper().strip()
+    sr = (subregion or "").upper().strip()
+    row = df[(df["country_code"] == cc) & (df["subregion"] == sr)]
+    if not row.empty:
+        return float(row.iloc[0]["grid_co2_kg_per_kwh"])
+    row = df[df["country_code"] == cc]
+    if not row.empty:
+        return float(row.iloc[0]["grid_co2_kg_per_kwh"])
+    raise LookupError(f"No grid factor for {country_code}/{subregion}")
+
+def df_lookup_fuel_co2_per_unit(fuel_type: str):
+    df = emission.current_tables().fuel_df
+    f = (fuel_type or "").upper().strip()
+    row = df[df["fuel_type"] == f]
+    if not row.empty:
+        return float(row.iloc[0]["kg_co2_per_unit"])
+    raise LookupError(f"No fuel emission factor for '{fuel_type}' (searched as '{f}')")
+
+def df_find_consumption(country_code: str, category: str, fuel_type: str):
+    df = emission.current_tables().cat_df
+    cc = (country_code or "").upper().strip()
+    cat = (category or "").upper().strip()
+    f = (fuel_type or "").upper().strip()
+    row = df[(df["country_code"] == cc) & (df["vehicle_category"] == cat) & (df["fuel_type"] == f)]
+    if row.empty:
+        row = df[(df["country_code"] == cc) & (df["fuel_type"] == f)]
+    if row.empty:
+        row = df[df["fuel_type"] == f]
+    if row.empty:
+        raise LookupError(f"No consumption data for {cc} / {cat} / {f}")
+    r = row.iloc[0]
+    return float(r["consumption_per_km"]), r.get("unit", "")
+
+
+# (country, category, fuel, subregion) - covers exact, country+fuel and fuel-only tiers
+CASES = [
+    ("IN", "CAR", "PETROL", ""),
+    ("US", "CAR", "DIESEL", ""),
+    ("FR", "CAR", "PETROL", ""),
+    ("DE", "CAR", "ELECTRIC", ""),
+]
+
+def _time(fn, args, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(*args)
+    return (time.perf_counter() - start) / iterations * 1e6  # us per call
+
+def run(iterations: int = 2000):
+    emission.reload_tables()
+    rows = []
+    for cc, cat, fuel, sr in CASES:
+        pairs = [
+            ("find_consumption", emission.find_consumption, df_find_consumption, (cc, cat, fuel)),
+            ("lookup_fuel", emission.lookup_fuel_co2_per_unit, df_lookup_fuel_co2_per_unit, (fuel,)),
+            ("lookup_grid", emission.lookup_grid_factor, df_lookup_grid_factor, (cc, sr)),
+        ]
+        for name, indexed, filtered, args in pairs:
+            try:
+                expected = filtered(*args)
+            except LookupError:
+                continue
+            assert indexed(*args) == expected, f"{name}{args}: index disagrees with DataFrame filter"
+            rows.append((name, args, _time(filtered, args, iterations), _time(indexed, args, iterations)))
+
+    print(f"{'lookup':<18}{'args':<34}{'df (us)':>10}{'index (us)':>12}{'speedup':>10}")
+    for name, args, df_us, idx_us in rows:
+        print(f"{name:<18}{str(args):<34}{df_us:>10.2f}{idx_us:>12.3f}{df_us / idx_us:>9.0f}x")
+    return rows
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
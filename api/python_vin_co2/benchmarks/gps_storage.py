@@ -0,0 +1,126 @@
+# benchmarks/gps_storage.py
+"""
+Per-ping document layout vs. the user-hour bucket layout (services/gps_store.py).
+
+Offline (default): BSON bytes per ping and index entries for a synthetic day.
+With --mongo: also writes the pings into scratch collections (bench_gps_logs /
+bench_gps_buckets) of MONGO_DBNAME, with the production indexes, and reports
+insert throughput, collStats sizes and the latency of reading one user-day.
+The scratch collections are dropped afterwards.
+
+Run from the python_vin_co2 folder:
+    python -m benchmarks.gps_storage [--users 50] [--pings 2000] [--mongo]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import bson
+
+from src import db
+from src.services import gps_store
+from src.services.gps_store import BucketStore, DocumentStore
+
+BATCH = 100   # pings per insert call, like a client flushing /gps/update/batch
+
+
+def synthetic_pings(users: int, pings_per_user: int, seed: int = 0):
+    """pings_per_user pings 10s apart per user, interleaved as they would arrive."""
+    rnd = random.Random(seed)
+    start = datetime(2025, 6, 1, 6, 0, 0)
+    out = []
+    for i in range(pings_per_user):
+        ts = start + timedelta(seconds=10 * i)
+        for u in range(users):
+            speed = rnd.uniform(0, 90)
+            out.append({
+                "user_id": f"bench-user-{u:05d}",
+                "lat": 12.9 + rnd.uniform(-0.1, 0.1),
+                "lon": 77.6 + rnd.uniform(-0.1, 0.1),
+                "speed_kmh": speed,
+                "distance_km": speed * 10 / 3600,
+                "timestamp": ts,
+                "date": ts.date().isoformat(),
+                "inferred_mode": "CAR" if speed > 25 else "BIKE",
+                "inserted_at": ts,
+            })
+    return out
+
+def offline_sizes(pings):
+    """BSON bytes per ping and index entries, without a server."""
+    docs = [dict(p, _id=bson.ObjectId()) for p in pings]
+    doc_bytes = sum(len(bson.encode(d)) for d in docs)
+
+    buckets = {}
+    for p in pings:
+        b = buckets.setdefault(BucketStore.bucket_id(p), {
+            "_id": BucketStore.bucket_id(p), "user_id": p["user_id"], "date": p["date"],
+            "hour": BucketStore.bucket_id(p).rsplit("|", 1)[1], "n": 0,
+            "first_ts": p["timestamp"], "last_ts": p["timestamp"], "updated_at": p["timestamp"],
+            **{f: [] for f in gps_store.PING_FIELDS}
+        })
+        for f in gps_store.PING_FIELDS:
+            b[f].append(p[f])
+        b["n"] += 1
+        b["last_ts"] = p["timestamp"]
+    bucket_bytes = sum(len(bson.encode(b)) for b in buckets.values())
+
+    n = len(pings)
+    print(f"pings: {n}, buckets: {len(buckets)}")
+    print(f"{'layout':<10}{'docs':>10}{'bytes/ping':>12}{'index entries':>15}")
+    # document: _id + user_ts + user_date_ts per ping; bucket: _id + 2 indexes per bucket
+    print(f"{'document':<10}{n:>10}{doc_bytes / n:>12.1f}{3 * n:>15}")
+    print(f"{'bucket':<10}{len(buckets):>10}{bucket_bytes / n:>12.1f}{3 * len(buckets):>15}")
+
+async def _bench_layout(store, coll_name, pings, users):
+    database = db.db
+    await database.drop_collection(coll_name)
+    source = "gps_logs" if store.layout == "document" else "gps_buckets"
+    for c, keys, options in db.INDEXES:
+        if c == source:
+            await database[coll_name].create_index(keys, **options)
+
+    start = time.perf_counter()
+    for i in range(0, len(pings), BATCH):
+        await store.insert([dict(p) for p in pings[i:i + BATCH]])
+    insert_s = time.perf_counter() - start
+
+    stats = await database.command("collStats", coll_name)
+    reads = []
+    for u in range(min(users, 20)):
+        start = time.perf_counter()
+        n = 0
+        async for _ in store.scan(day=pings[0]["date"], user_id=f"bench-user-{u:05d}"):
+            n += 1
+        reads.append((time.perf_counter() - start) * 1000)
+    await database.drop_collection(coll_name)
+    return {
+        "pings_per_s": len(pings) / insert_s,
+        "size": stats.get("size", 0),
+        "storage": stats.get("storageSize", 0),
+        "indexes": stats.get("totalIndexSize", 0),
+        "read_ms": statistics.median(reads),
+    }
+
+async def online(pings, users):
+    print(f"\n{'layout':<10}{'pings/s':>10}{'data MB':>10}{'disk MB':>10}{'index MB':>10}{'day read ms':>13}")
+    for store, name in ((DocumentStore(db.db["bench_gps_logs"]), "bench_gps_logs"),
+                        (BucketStore(db.db["bench_gps_buckets"]), "bench_gps_buckets")):
+        r = await _bench_layout(store, name, pings, users)
+        mb = 1024 * 1024
+        print(f"{store.layout:<10}{r['pings_per_s']:>10.0f}{r['size'] / mb:>10.2f}{r['storage'] / mb:>10.2f}"
+              f"{r['indexes'] / mb:>10.2f}{r['read_ms']:>13.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--pings", type=int, default=2000, help="pings per user")
+    parser.add_argument("--mongo", action="store_true", help="also write to scratch collections on MONGO_URI")
+    args = parser.parse_args()
+    pings = synthetic_pings(args.users, args.pings)
+    offline_sizes(pings)
+    if args.mongo:
+        asyncio.run(online(pings, args.users))
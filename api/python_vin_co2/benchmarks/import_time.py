@@ -0,0 +1,78 @@
+# benchmarks/import_time.py
+"""
+Import-time budget for the service: runs `python -X importtime -c "import src.main"`
+in a fresh interpreter without MONGO_URI / GEMINI_API_KEY and fails (exit 1) when
+
+    - the import raises (e.g. a module needs a secret at import time),
+    - a heavy dependency is imported eagerly (pandas, numpy, httpx, google.genai;
+      they belong in the function or startup hook that uses them),
+    - a Mongo client is created at import, or
+    - src.main takes longer than the budget (IMPORT_BUDGET_MS, default 1000 ms).
+
+Run from the python_vin_co2 folder (CI can run it as-is):
+    python -m benchmarks.import_time [--budget-ms 1000] [--top 15] [--runs 3]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1000"))
+LAZY_MODULES = ("pandas", "numpy", "httpx", "google.genai")
+
+# runs in the child: the import itself plus the no-client check
+_CHILD = (
+    "import src.main, src.db as db; "
+    "assert db.pool.client is None, 'a Mongo client was created at import'"
+)
+
+# "import time:  self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def _env() -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("MONGO_URI", "GEMINI_API_KEY")}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def measure() -> dict:
+    """One cold import in a child interpreter: {module: (self_us, cumulative_us, depth)}."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD],
+                          capture_output=True, text=True, env=_env())
+    if proc.returncode != 0:
+        error = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))
+        raise SystemExit(f"import src.main failed:\n{error}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            modules[m.group(4)] = (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+    return modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="slowest top-level imports to list")
+    parser.add_argument("--runs", type=int, default=3, help="imports to take the fastest of")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.runs))]
+    modules = min(runs, key=lambda r: r["src.main"][1])
+    total_ms = modules["src.main"][1] / 1000
+
+    print(f"import src.main: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms, best of {len(runs)})")
+    print(f"{'cumulative ms':>14}  module")
+    children = [(cum, name) for name, (_, cum, depth) in modules.items() if depth == 1]
+    for cum, name in sorted(children, reverse=True)[:args.top]:
+        print(f"{cum / 1000:>14.1f}  {name}")
+
+    failures = [f"{name} is imported by src.main" for name in LAZY_MODULES if name in modules]
+    if total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+    for f in failures:
+        print("FAIL:", f)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# benchmarks/ocr_event_loop.py
+"""
+Shows that /upload-vin no longer stalls the event loop: a fake OCR backend
+sleeps for OCR_DELAY seconds while /ping latency is sampled. Uploads beyond
+the pool + queue size are expected to come back as 429.
+
+Run from the python_vin_co2 folder (MONGO_URI / GEMINI_API_KEY can be dummies,
+nothing is sent to Mongo or Gemini):
+    python -m benchmarks.ocr_event_loop [uploads] [delay_s]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+from src.main import app
+from src.services import gemini_ocr
+
+
+async def _sample_ping(client: httpx.AsyncClient, stop: asyncio.Event, out: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/ping")
+        out.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+async def run(uploads: int = 16, delay_s: float = 1.0):
+    # blocking, slow and VIN-free, so the request ends right after OCR
+    gemini_ocr.set_ocr_backend(lambda data, mime: time.sleep(delay_s) or "NO VIN HERE")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(_sample_ping(client, stop, baseline))
+        await asyncio.sleep(0.5)
+        stop.set()
+        await sampler
+
+        loaded = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(_sample_ping(client, stop, loaded))
+        files = {"file": ("vin.jpg", b"\xff\xd8fake", "image/jpeg")}
+        responses = await asyncio.gather(*(
+            client.post("/upload-vin", params={"user_id": f"bench{i}"}, files=files)
+            for i in range(uploads)
+        ))
+        stop.set()
+        await sampler
+
+    codes = {}
+    for r in responses:
+        codes[r.status_code] = codes.get(r.status_code, 0) + 1
+
+    def summary(xs):
+        xs = sorted(xs)
+        return f"n={len(xs)} median={statistics.median(xs):.2f}ms p99={xs[int(len(xs) * 0.99) - 1]:.2f}ms"
+
+    print(f"/ping idle:              {summary(baseline)}")
+    print(f"/ping during {uploads} uploads: {summary(loaded)}")
+    print(f"/upload-vin status codes: {codes}")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    d = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    asyncio.run(run(n, d))
@@ -0,0 +1,85 @@
+# benchmarks/ocr_payload.py
+"""
+Bytes sent and latency per VIN image, raw upload vs. the pre-processed
+pipeline, against a local stub of the Gemini generateContent endpoint.
+
+Run from the python_vin_co2 folder (Pillow required; nothing leaves the machine):
+    python -m benchmarks.ocr_payload [images]
+"""
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw, ImageFilter
+
+STUB_VIN = "1HGCM82633A004352"
+_received = []  # request body sizes seen by the stub
+
+
+class _StubGemini(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        _received.append(len(body))
+        payload = json.dumps({
+            "candidates": [{"content": {"role": "model", "parts": [{"text": f"VIN {STUB_VIN}"}]}}]
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def synthetic_vin_photo(seed: int, size=(4032, 3024)) -> bytes:
+    """Noisy phone-sized photo with a dark VIN plate strip somewhere in the middle."""
+    rnd = random.Random(seed)
+    img = Image.effect_noise(size, 40).convert("RGB").filter(ImageFilter.GaussianBlur(3))
+    draw = ImageDraw.Draw(img)
+    top = rnd.randint(size[1] // 3, size[1] // 2)
+    draw.rectangle([0, top, size[0], top + size[1] // 8], fill=(20, 20, 20))
+    for i in range(17):
+        x = 200 + i * (size[0] - 400) // 17
+        draw.rectangle([x, top + 60, x + 120, top + size[1] // 8 - 60], fill=(235, 235, 235))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+
+def run(images: int = 5):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("GEMINI_API_KEY", "stub")
+
+    from src.services import gemini_ocr  # picks up GEMINI_BASE_URL
+    gemini_ocr.set_local_backend(None)
+
+    print(f"{'image':<7}{'raw bytes':>12}{'sent raw':>12}{'raw ms':>9}{'sent prep':>12}{'prep ms':>9}{'ratio':>8}")
+    for i in range(images):
+        photo = synthetic_vin_photo(i)
+
+        start = time.perf_counter()
+        gemini_ocr.extract_text_from_image_gemini(photo, "image/jpeg")
+        raw_ms = (time.perf_counter() - start) * 1000
+        sent_raw = _received[-1]
+
+        start = time.perf_counter()
+        text = gemini_ocr._ocr_pipeline(photo, "image/jpeg")
+        prep_ms = (time.perf_counter() - start) * 1000
+        sent_prep = _received[-1]
+        assert STUB_VIN in text
+
+        print(f"{i:<7}{len(photo):>12}{sent_raw:>12}{raw_ms:>9.1f}{sent_prep:>12}{prep_ms:>9.1f}{sent_raw / sent_prep:>7.1f}x")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
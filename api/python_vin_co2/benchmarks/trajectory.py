@@ -0,0 +1,96 @@
+# benchmarks/trajectory.py
+"""
+Scalar GPS helpers (services/gps.py) vs. the NumPy trajectory engine on one
+synthetic user-day, at 10k / 100k / 1M points. Before timing, every size is
+checked for equal results (segment km, smoothed speeds, modes, km per mode).
+
+Run from the python_vin_co2 folder (MONGO_URI can be a dummy, nothing is sent to Mongo):
+    python -m benchmarks.trajectory [sizes...]
+"""
+import math
+import sys
+import time
+
+import numpy as np
+
+from src.services import trajectory
+from src.services.gps import haversine_km, infer_mode_from_speed, smooth_speeds
+
+
+def synthetic_day(n: int, seed: int = 0):
+    """Random walk of n pings, ~1s apart, with gaps in coordinates, speeds and distances."""
+    rnd = np.random.default_rng(seed)
+    lat = 12.9 + np.cumsum(rnd.normal(0, 1e-4, n))
+    lon = 77.6 + np.cumsum(rnd.normal(0, 1e-4, n))
+    speed = rnd.gamma(2.0, 15.0, n)
+    dist = rnd.uniform(0, 0.05, n)
+    ts = 1.7e9 + np.cumsum(rnd.uniform(0.5, 1.5, n))
+    for arr, share in ((lat, 0.01), (speed, 0.05), (dist, 0.5)):
+        arr[rnd.random(n) < share] = np.nan
+    lon[np.isnan(lat)] = np.nan
+    return lat, lon, speed, dist, ts
+
+def _opt(x):
+    return None if math.isnan(x) else float(x)
+
+def as_lists(*arrays):
+    """Arrays -> lists with NaN -> None, the shape the scalar code gets from Mongo docs."""
+    return [[_opt(v) for v in a] for a in arrays]
+
+def scalar_day(lats, lons, speeds, dists):
+    """The per-point loop of the original /gps/daily-modes (missing speed = 0)."""
+    seg = []
+    for i in range(len(lats)):
+        if dists[i] is not None:
+            seg.append(dists[i])
+        elif i == 0 or None in (lats[i - 1], lons[i - 1], lats[i], lons[i]):
+            seg.append(0.0)
+        else:
+            seg.append(haversine_km(lats[i - 1], lons[i - 1], lats[i], lons[i]))
+    smoothed = smooth_speeds([s if s is not None else 0.0 for s in speeds], window=3)
+    modes = [infer_mode_from_speed(s) for s in smoothed]
+    by_mode = {}
+    for mode, km in zip(modes, seg):
+        by_mode[mode] = by_mode.get(mode, 0.0) + km
+    return seg, smoothed, modes, by_mode
+
+def check_equivalent(n: int):
+    lat, lon, speed, dist, ts = synthetic_day(n, seed=n)
+    seg, smoothed, modes, by_mode = scalar_day(*as_lists(lat, lon, speed, dist))
+    day = trajectory.analyze_day(lat, lon, speed, ts, dist, derive_missing_speeds=False)
+    assert np.allclose(day.segment_km, seg, rtol=1e-9, atol=1e-6), "segment_km differs"  # 1e-6 km = 1mm
+    assert np.allclose(day.smoothed_kmh, smoothed, rtol=1e-9, atol=1e-9), "smoothed speeds differ"
+    # a cumulative-sum mean can land a hair off a threshold; allow only those points to differ
+    differing = np.flatnonzero(day.modes != np.array(modes))
+    assert all(min(abs(smoothed[i] - b) for b in trajectory.MODE_BOUNDS) < 1e-9 for i in differing), "modes differ"
+    if differing.size == 0:
+        assert by_mode.keys() == day.by_mode.keys(), "mode set differs"
+        for mode, km in by_mode.items():
+            assert math.isclose(day.by_mode[mode], km, rel_tol=1e-9, abs_tol=1e-6), f"{mode} km differs"
+
+    # derived speeds: missing speed = segment km / elapsed hours
+    derived = trajectory.analyze_day(lat, lon, speed, ts, dist)
+    i = next(i for i in range(1, n) if math.isnan(speed[i]))
+    assert math.isclose(derived.speed_kmh[i], derived.segment_km[i] / ((ts[i] - ts[i - 1]) / 3600)), "derived speed"
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def run(sizes):
+    print(f"{'points':>10}{'scalar ms':>12}{'numpy ms':>11}{'speedup':>9}")
+    for n in sizes:
+        check_equivalent(n)
+        lat, lon, speed, dist, ts = synthetic_day(n)
+        lists = as_lists(lat, lon, speed, dist)
+        repeat = 3 if n <= 100_000 else 1
+        scalar_ms = _best_of(lambda: scalar_day(*lists), repeat)
+        numpy_ms = _best_of(lambda: trajectory.analyze_day(lat, lon, speed, ts, dist, derive_missing_speeds=False), repeat)
+        print(f"{n:>10}{scalar_ms:>12.1f}{numpy_ms:>11.1f}{scalar_ms / numpy_ms:>8.0f}x")
+
+if __name__ == "__main__":
+    run([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -1,25 +1,50 @@
 # src/db.py
+import asyncio
 import os
+
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from src.mongo_pool import MongoPool
 
 load_dotenv()  # loads .env from project root
 
 MONGO_URI = os.getenv("MONGO_URI")
 DBNAME = os.getenv("MONGO_DBNAME", "carbonwise_python")
 
-if not MONGO_URI:
-    raise RuntimeError("MONGO_URI not set in .env")
+# Client, pool settings and pool metrics live in src/mongo_pool.py (shared with
+# the diet service). The client is created on first use (not at import), so
+# importing this module needs neither MONGO_URI nor a reachable server.
+pool = MongoPool(MONGO_URI, DBNAME, serverSelectionTimeoutMS=5000)   # fail fast in dev if Atlas isn't reachable
+pool_stats = pool.stats
+get_client = pool.get_client
+get_db = pool.get_db
+warm_pool = pool.warm_pool
+close_client = pool.close
+db = pool.db
+
+
+class _LazyCollection:
+    """Stands in for a Motor collection; resolves it on every attribute access."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+    def __repr__(self):
+        return f"<lazy collection {DBNAME}.{self.name}>"
 
-# Fail fast in dev if Atlas isn't reachable (tunable)
-client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-db = client[DBNAME]
 
 # Collections used by the app
-users_coll = db["users"]
-vehicles_coll = db["vehicles"]
-gps_coll = db["gps_logs"]
-emissions_coll = db["emissions"]
+users_coll = _LazyCollection("users")
+vehicles_coll = _LazyCollection("vehicles")
+gps_coll = _LazyCollection("gps_logs")
+gps_buckets_coll = _LazyCollection("gps_buckets")   # GPS_STORAGE=bucket layout (services/gps_store.py)
+emissions_coll = _LazyCollection("emissions")
+rollups_coll = _LazyCollection("daily_rollups")   # per user/day/mode distance totals (services/rollups.py)
+vin_cache_coll = _LazyCollection("vin_cache")     # vPIC decodes keyed by VIN / pattern key (services/vin_lookup.py)
 
 # Helper functions
 async def ping_db() -> bool:
@@ -36,9 +61,138 @@ async def ping_db() -> bool:
         print("MongoDB ping failed:", e)
         return False
 
-def close_client():
-    """Close the underlying motor client (useful in tests or shutdown)."""
-    try:
-        client.close()
-    except Exception:
-        pass
+
+# ------------------------------------------------------------------
+# Index provisioning
+# ------------------------------------------------------------------
+# (collection, keys, options) - one entry per hot query shape in main.py,
+# services/gps.py and services/rollups.py. create_index is a no-op when an
+# identical index already exists, so this is safe to run on every startup.
+INDEXES = [
+    # /gps/update history read: {user_id} sorted by timestamp desc
+    ("gps_logs", [("user_id", 1), ("timestamp", -1)], {"name": "user_ts"}),
+    # /calculate/daily fallback scan, daily aggregate and rollup backfill: {user_id, date} sorted by timestamp
+    ("gps_logs", [("user_id", 1), ("date", 1), ("timestamp", 1)], {"name": "user_date_ts"}),
+    # GPS_STORAGE=bucket: day scans by (user_id, date) in time order, latest-bucket reads by user
+    ("gps_buckets", [("user_id", 1), ("date", 1), ("first_ts", 1)], {"name": "user_date_first_ts"}),
+    ("gps_buckets", [("user_id", 1), ("last_ts", -1)], {"name": "user_last_ts"}),
+    ("vehicles", [("user_id", 1)], {"name": "user_id"}),
+    ("users", [("user_id", 1)], {"name": "user_id"}),
+    ("users", [("userid", 1)], {"name": "userid", "sparse": True}),
+    # one record per user-day (/calculate/daily and the batch upsert on it); deployments
+    # from before it was unique need `python -m src.db --migrate` once
+    ("emissions", [("user_id", 1), ("date", 1)], {"name": "user_date", "unique": True}),
+    # /reports/emissions range query, covered by the index (no document fetch)
+    ("emissions", [("user_id", 1), ("date", 1), ("created_at", 1), ("total_kg_co2", 1), ("distance_km", 1)],
+     {"name": "user_date_totals"}),
+    ("daily_rollups", [("user_id", 1), ("date", 1), ("mode", 1)], {"name": "user_date_mode", "unique": True}),
+]
+
+# (collection, filter, sort) samples of every hot query, used by check_hot_queries
+HOT_QUERIES = [
+    ("gps_logs", {"user_id": "u"}, [("timestamp", -1)]),
+    ("gps_logs", {"user_id": "u", "date": "2000-01-01"}, [("timestamp", 1)]),
+    ("gps_logs", {"user_id": "u", "date": "2000-01-01"}, None),
+    ("gps_buckets", {"user_id": "u", "date": "2000-01-01"}, [("first_ts", 1)]),
+    ("gps_buckets", {"user_id": "u"}, [("last_ts", -1)]),
+    ("vehicles", {"user_id": "u"}, None),
+    ("users", {"user_id": "u"}, None),
+    ("users", {"userid": "u"}, None),
+    ("daily_rollups", {"user_id": "u", "date": "2000-01-01"}, None),
+    ("emissions", {"user_id": "u", "date": {"$gte": "2000-01-01", "$lte": "2000-12-31"}}, [("date", 1), ("created_at", 1)]),
+]
+
+async def ensure_indexes(database=None) -> list:
+    """Create every index in INDEXES (idempotent). Returns the index names."""
+    database = db if database is None else database
+    names = []
+    for coll_name, keys, options in INDEXES:
+        try:
+            names.append(await database[coll_name].create_index(keys, **options))
+        except OperationFailure as e:
+            # 85/86: an older index with the same name or keys but other options
+            # 11000: existing duplicates block a unique index
+            if e.code not in (85, 86, 11000):
+                raise
+            print(f"Warning: index {coll_name}.{options['name']} not created (code {e.code});"
+                  " run `python -m src.db --migrate`")
+    return names
+
+async def dedupe_emissions(database=None) -> int:
+    """
+    Keep the newest record (created_at, then _id) of every (user_id, date) in
+    emissions and delete the others. Returns the number of records deleted.
+    """
+    database = db if database is None else database
+    coll = database["emissions"]
+    cursor = coll.aggregate([
+        {"$sort": {"user_id": 1, "date": 1, "created_at": -1, "_id": -1}},
+        {"$group": {"_id": {"user_id": "$user_id", "date": "$date"}, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    deleted = 0
+    async for group in cursor:
+        deleted += (await coll.delete_many({"_id": {"$in": group["ids"][1:]}})).deleted_count
+    return deleted
+
+async def migrate_emissions_index(database=None) -> int:
+    """
+    Replace the old non-unique emissions user_date index with the unique one,
+    deduping first. Run off-peak: a duplicate written between the dedupe and
+    the index build makes the build fail (just run it again).
+    """
+    database = db if database is None else database
+    coll = database["emissions"]
+    deleted = await dedupe_emissions(database)
+    old = (await coll.index_information()).get("user_date")
+    if old is not None and not old.get("unique"):
+        await coll.drop_index("user_date")
+    await coll.create_index([("user_id", 1), ("date", 1)], name="user_date", unique=True)
+    return deleted
+
+def _plan_stages(plan) -> list:
+    """All 'stage' values anywhere in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for v in plan.values():
+            stages.extend(_plan_stages(v))
+    elif isinstance(plan, list):
+        for v in plan:
+            stages.extend(_plan_stages(v))
+    return stages
+
+async def check_hot_queries(database=None):
+    """
+    explain() every HOT_QUERIES entry and raise RuntimeError if any winning
+    plan contains a COLLSCAN. Works against any server (or stand-in) that
+    implements explain; run ensure_indexes first.
+    """
+    database = db if database is None else database
+    failures = []
+    for coll_name, flt, sort in HOT_QUERIES:
+        cursor = database[coll_name].find(flt)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in _plan_stages(winning):
+            failures.append(f"{coll_name} {flt} sort={sort}")
+    if failures:
+        raise RuntimeError("Hot queries doing a COLLSCAN: " + "; ".join(failures))
+    return True
+
+
+if __name__ == "__main__":
+    import sys
+
+    async def _main():
+        if "--migrate" in sys.argv:
+            print("duplicate emissions records deleted:", await migrate_emissions_index())
+        print("indexes:", await ensure_indexes())
+        if "--check" in sys.argv:
+            await check_hot_queries()
+            print("explain check passed: no COLLSCAN on hot queries")
+
+    asyncio.run(_main())
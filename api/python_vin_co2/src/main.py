@@ -243,19 +243,25 @@
 
 
 import os
+import asyncio
 import logging
-import math
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from typing import Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime, date
 from dateutil.parser import parse as parse_dt
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 # Assuming these imports are correct based on your previous tracebacks
-from .db import users_coll, vehicles_coll, gps_coll, emissions_coll, ping_db
-from .services.gemini_ocr import extract_text_from_image_gemini
+from .db import users_coll, vehicles_coll, emissions_coll, ping_db, ensure_indexes, warm_pool, close_client, pool_stats
+from .services.gemini_ocr import extract_text_async, OcrBusyError, ocr_stats
 from .services.vin_lookup import decode_vin_vpic
-from .services import emission
+from .services.vehicles import categorize_vehicle, router as vehicles_router
+from .services.reports import router as reports_router
+from .services.gps_store import get_store
+from .services import emission, gemini_ocr, rollups, vin_lookup, write_behind
+from .services.daily_batch import run_daily_batch
 from .utils.validators import extract_vin_from_text, normalize_fuel
 
 # Assuming routers are imported like this
@@ -271,12 +277,47 @@ app = FastAPI(title="Python VIN->CO2 Service")
 
 app.add_middleware(CORSMiddleware, allow_origins=[""], allow_methods=[""], allow_headers=["*"])
 
+# Poll transport_co2_data/*.xlsx for changes every N seconds (0 disables the watcher)
+TABLES_WATCH_INTERVAL = float(os.getenv("TABLES_WATCH_INTERVAL", "30"))
+# Optional shared secret for /admin/* endpoints (sent as X-Admin-Token)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Create the Mongo indexes for the hot queries at startup (idempotent)
+ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "1") != "0"
+
+_background_tasks = []
+
 @app.on_event("startup")
 async def startup_event():
     ok = await ping_db()
     if not ok:
         print("⚠ WARNING: Could not connect to MongoDB Atlas.")
-    emission.reload_tables()
+    else:
+        try:
+            await warm_pool()
+        except Exception:
+            logger.exception("Mongo pool warm-up failed; connections will open on demand")
+        if ENSURE_INDEXES:
+            try:
+                await ensure_indexes()
+            except Exception:
+                logger.exception("ensure_indexes failed; hot queries may fall back to collection scans")
+    await emission.reload_tables_async(force=False)
+    if TABLES_WATCH_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(emission.watch_tables(TABLES_WATCH_INTERVAL)))
+    if write_behind.GPS_WRITE_BEHIND:
+        write_behind.queue.start()
+    if not gemini_ocr.API_KEY:
+        print("⚠ WARNING: GEMINI_API_KEY not set; remote VIN OCR will fail.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await write_behind.queue.stop()
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await vin_lookup.close_client()
+    close_client()
 
 # ----------------- Utility Function (Required Fix) -----------------
 
@@ -317,11 +358,48 @@ def ping():
     print("PING endpoint hit")
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """In-process cache/pool counters for this worker."""
+    return {
+        "ping_cache": gps_service.recent_speeds.stats(),
+        "ocr": ocr_stats(),
+        "vin_cache": vin_lookup.cache_stats(),
+        "emission_memo": emission.memo_stats(),
+        "gps_write_behind": write_behind.queue.stats(),
+        "mongo_pool": pool_stats.snapshot()
+    }
+
+@app.post("/admin/reload-tables")
+async def admin_reload_tables(force: bool = False, x_admin_token: Optional[str] = Header(None)):
+    """Hot-reload the emission tables without restarting workers (parsing runs in a thread)."""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    previous = emission.current_tables().version
+    try:
+        tables = await emission.reload_tables_async(force=force)
+    except Exception as e:
+        logger.exception("emission table reload failed")
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving version {previous}: {e}")
+    return {
+        "ok": True,
+        "changed": tables.version != previous,
+        "previous_version": previous,
+        "table_version": tables.version,
+        "loaded_at": tables.loaded_at.isoformat()
+    }
+
 @app.post("/upload-vin")
 async def upload_vin(user_id: str, file: UploadFile = File(...)):
     raw = await file.read()
     mime = file.content_type or "image/jpeg"
-    text = extract_text_from_image_gemini(raw, mime_type=mime)
+    # OCR runs on a bounded thread pool so the event loop keeps serving other requests
+    try:
+        text = await extract_text_async(raw, mime_type=mime)
+    except OcrBusyError:
+        raise HTTPException(status_code=429, detail="OCR is busy, please retry shortly", headers={"Retry-After": "2"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="OCR timed out, please retry")
     vin = extract_vin_from_text(text)
     if not vin:
         return {"vin": None, "decoded": None, "message": "VIN not detected. Send clearer/cropped VIN image."}
@@ -330,17 +408,7 @@ async def upload_vin(user_id: str, file: UploadFile = File(...)):
     # map category heuristics (simple)
     body = (decoded.get("BodyClass") or "") if decoded else ""
     vehicle_type = (decoded.get("VehicleType") or "") if decoded else ""
-    
-    # Heuristic category mapping
-    cat = None
-    if "TRUCK" in str(body).upper() or "TRUCK" in str(vehicle_type).upper():
-        cat = "TRUCK_HEAVY"
-    elif "BUS" in str(body).upper() or "BUS" in str(vehicle_type).upper():
-        cat = "BUS"
-    elif "MOTORCYCLE" in str(body).upper() or "MOTORCYCLE" in str(vehicle_type).upper():
-        cat = "MOTORCYCLE"
-    else:
-        cat = "CAR"
+    cat = categorize_vehicle(body, vehicle_type)
 
     fuel = decoded.get("FuelTypePrimary") or decoded.get("FuelType") or decoded.get("FuelTypePrimary1") or None
     fuel_norm = normalize_fuel(fuel)
@@ -359,7 +427,7 @@ async def upload_vin(user_id: str, file: UploadFile = File(...)):
 # --------------- The Fixed Daily Calculation Endpoint ------------------
 
 @app.post("/calculate/daily")
-async def calculate_daily(user_id: str, country_code: str = None, subregion: str = ""):
+async def calculate_daily(user_id: str, country_code: str = None, subregion: str = "", day: Optional[str] = None):
     # defensive sanitization: trim whitespace/newlines
     if user_id is None:
         raise HTTPException(status_code=400, detail="user_id is required")
@@ -370,6 +438,12 @@ async def calculate_daily(user_id: str, country_code: str = None, subregion: str
     if user_id == "":
         raise HTTPException(status_code=400, detail="user_id cannot be empty or whitespace")
 
+    # day to compute (default today); recomputing a day replaces its record
+    try:
+        today = date.fromisoformat(day.strip()).isoformat() if day and day.strip() else date.today().isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+
     try:
         # Lookup vehicle (exact match by user_id)
         vehicle = await vehicles_coll.find_one({"user_id": user_id})
@@ -388,41 +462,27 @@ async def calculate_daily(user_id: str, country_code: str = None, subregion: str
         if not country_code:
             raise HTTPException(status_code=400, detail="country_code required (or add to user profile).")
 
-        # Sum today's gps distance
-        today = date.today().isoformat()
-        cursor = gps_coll.aggregate([
-            {"$match": {"user_id": user_id, "date": today}},
-            {"$group": {"_id": "$user_id", "total": {"$sum": "$distance_km"}}}
-        ])
-        r = await cursor.to_list(length=1)
-        distance = float(r[0]["total"]) if r and r[0].get("total") is not None else 0.0
+        # Sum the day's client distance_km: from the ingest-time rollups when they
+        # cover every stored ping, else from the raw logs
+        store = get_store()
+        rollup = await rollups.read_daily_distance(user_id, today)
+        if rollup is not None and rollup["pings"] == await store.count(today, user_id):
+            distance = rollup["distance_km"]
+        else:
+            # no rollup, or pings stored before rollups existed / missed by them
+            totals = await store.distance_totals(today, user_id=user_id)
+            distance = totals.get(user_id, 0.0)
 
         if distance <= 0:
-            # fallback: compute haversine sum from lat/lon if needed
-            docs = await gps_coll.find({"user_id": user_id, "date": today}).sort("timestamp", 1).to_list(length=None)
+            # no client distances: sum lat/lon hops over the day in timestamp order
+            docs = [d async for d in store.scan(day=today, user_id=user_id, fields=("lat", "lon"))]
             if docs and len(docs) > 1:
-                from math import radians, sin, cos, atan2, sqrt
-                def haversine_km(lat1, lon1, lat2, lon2):
-                    R = 6371.0
-                    phi1 = radians(lat1); phi2 = radians(lat2)
-                    dphi = radians(lat2 - lat1); dlambda = radians(lon2 - lon1)
-                    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-                    c = 2 * atan2(sqrt(a), sqrt(1-a))
-                    return R * c
-                total = 0.0
-                prev = None
-                for d in docs:
-                    lat = d.get("lat"); lon = d.get("lon")
-                    if lat is None or lon is None:
-                        prev = None
-                        continue
-                    if prev:
-                        total += haversine_km(prev[0], prev[1], lat, lon)
-                    prev = (lat, lon)
-                distance = total
+                from .services import trajectory   # numpy is imported on first use
+                cols = trajectory.columns_from_docs(docs)
+                distance = float(trajectory.hop_km(cols["lat"], cols["lon"]).sum())
 
         if distance <= 0:
-            raise HTTPException(status_code=400, detail=f"No GPS distance recorded for today ({today}). Insert gps pings or ensure distance_km numeric.")
+            raise HTTPException(status_code=400, detail=f"No GPS distance recorded for {today}. Insert gps pings or ensure distance_km numeric.")
 
         # compute per-km emission
         try:
@@ -432,73 +492,15 @@ async def calculate_daily(user_id: str, country_code: str = None, subregion: str
             # If the calculation fails with an underlying exception (e.g., KeyError), return a 500 error
             raise HTTPException(status_code=500, detail=f"compute_co2_per_km failed: {e}")
 
-        # --- Robust extraction of returned emission keys and computation ---
-        # emission.compute_co2_per_km may return keys named differently depending on loader:
-        # - kg_co2_per_unit (or) co2_kg_per_unit  <-- per fuel unit (kg per litre, or kg per kg)
-        # - kg_co2_per_km   (or) co2_kg_per_km   <-- per km (already multiplied)
-        # - consumption_per_km, consumption_unit
-        #
-        # We'll support all reasonable variants, compute missing values, and sanitize NaNs.
+        record = emission.build_daily_record(user_id, today, vehicle, distance, res)
 
-        def _safe_float(v, default=None):
-            try:
-                f = float(v)
-                if math.isnan(f):
-                    return default
-                return f
-            except Exception:
-                return default
-
-        # prefer canonical names but accept variants
-        kg_co2_per_unit = res.get("kg_co2_per_unit") or res.get("co2_kg_per_unit") or res.get("kg_co2_per_unit")
-        kg_co2_per_km   = res.get("kg_co2_per_km")   or res.get("co2_kg_per_km")   or res.get("kg_co2_per_km")
-
-        # try to compute kg_co2_per_km if missing using consumption_per_km * kg_co2_per_unit
-        if kg_co2_per_km is None:
-            cons = res.get("consumption_per_km")
-            if cons is not None and (kg_co2_per_unit is not None):
-                try:
-                    kg_co2_per_km = float(cons) * float(kg_co2_per_unit)
-                except Exception:
-                    kg_co2_per_km = None
-
-        # sanitize numeric values (convert NaN to None)
-        kg_co2_per_unit_f = _safe_float(kg_co2_per_unit, default=None)
-        kg_co2_per_km_f   = _safe_float(kg_co2_per_km, default=None)
-
-        # If nothing could be computed, set numeric results to 0.0 (avoid NaN JSON errors)
-        if kg_co2_per_km_f is None:
-            kg_co2_per_km_f = 0.0
-
-        total_kg = float(distance) * kg_co2_per_km_f
-
-        # Make sure details contain canonical keys (helpful for clients)
-        # Avoid overwriting useful existing values, just normalize
-        if "kg_co2_per_unit" not in res and kg_co2_per_unit_f is not None:
-            res["kg_co2_per_unit"] = kg_co2_per_unit_f
-        if "kg_co2_per_km" not in res:
-            res["kg_co2_per_km"] = kg_co2_per_km_f
-
-        # convert any NaN float entries inside res to None to avoid JSON errors
-        for k, v in list(res.items()):
-            if isinstance(v, float) and math.isnan(v):
-                res[k] = None
-
-        record = {
-            "user_id": user_id,
-            "date": today,
-            "vehicle": {"vin": vehicle.get("vin"), "vehicle_category": vehicle_category, "fuel_type": fuel_type},
-            "distance_km": float(distance),
-            "co2_kg_per_unit": kg_co2_per_unit_f if kg_co2_per_unit_f is not None else 0.0,
-            "co2_kg_per_km": kg_co2_per_km_f,
-            "total_kg_co2": total_kg,
-            "details": res,
-            "created_at": datetime.utcnow().isoformat()
-        }
-
-        insert_res = await emissions_coll.insert_one(record)
+        # one record per user-day: recomputing replaces it instead of adding a duplicate
+        stored = await emissions_coll.find_one_and_replace(
+            {"user_id": user_id, "date": today}, record,
+            projection={"_id": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
         # attach stringified _id for response
-        record["_id"] = str(insert_res.inserted_id)
+        record["_id"] = str(stored["_id"])
 
         # Make sure everything returned is JSON safe (ObjectId converted to str already)
         safe_record = _to_json_safe(record)
@@ -511,9 +513,30 @@ async def calculate_daily(user_id: str, country_code: str = None, subregion: str
         raise HTTPException(status_code=500, detail="Internal server error while calculating daily emissions")
 
 
+@app.post("/calculate/daily/batch")
+async def calculate_daily_batch(day: Optional[str] = None, country_code: Optional[str] = None, subregion: str = "",
+                                x_admin_token: Optional[str] = Header(None)):
+    """Nightly job: emissions for every user with GPS data on `day` (default today), in one pass."""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if day:
+        try:
+            day = date.fromisoformat(day.strip()).isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+    country_code = country_code.strip() if country_code else None
+    try:
+        return await run_daily_batch(day=day, country_code=country_code, subregion=(subregion or "").strip())
+    except Exception as e:
+        logger.exception("daily batch failed")
+        raise HTTPException(status_code=500, detail=f"Daily batch failed: {e}")
+
+
 # include routers (so gps and mode endpoints work)
 app.include_router(gps_router)
 app.include_router(mode_router)
+app.include_router(vehicles_router)
+app.include_router(reports_router)
 
 
 
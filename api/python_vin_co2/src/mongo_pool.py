@@ -0,0 +1,180 @@
+# src/mongo_pool.py
+"""
+Mongo client lifecycle shared by the Python services: a Motor client created
+on first use (not at import), a tunable connection pool and pool counters for
+/metrics. src/db.py builds the VIN/GPS service's pool; the diet service
+(run from the api folder) imports this module as python_vin_co2.src.mongo_pool.
+
+Pool settings are read from the environment when a MongoPool is built; each
+uvicorn worker process has its own client:
+    MONGO_MAX_POOL_SIZE          default 100
+    MONGO_MIN_POOL_SIZE          default 0, opened at startup by warm_pool()
+    MONGO_MAX_IDLE_MS            0 = keep idle connections
+    MONGO_WAIT_QUEUE_TIMEOUT_MS  0 = wait for a free connection
+    MONGO_COMPRESSORS            e.g. "zstd,snappy,zlib"
+"""
+import asyncio
+import os
+import threading
+from typing import Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Connection pool counters for /metrics. Events arrive from pymongo's
+    threads (Motor runs operations on a thread pool), hence the lock.
+    """
+
+    def __init__(self, max_pool_size: int, min_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.open = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures: Dict[str, int] = {}
+            self.wait_s_total = 0.0
+            self.wait_s_max = 0.0
+            self.pool_clears = 0
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", None) or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkouts += 1
+            self.wait_s_total += wait
+            self.wait_s_max = max(self.wait_s_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            reason = str(event.reason)
+            self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    # the remaining pool events carry nothing we report
+    def connection_check_out_started(self, event): pass
+    def connection_ready(self, event): pass
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_pool_size": self.max_pool_size,
+                "min_pool_size": self.min_pool_size,
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "wait_ms_avg": round(self.wait_s_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_s_max * 1000, 3),
+                "pool_clears": self.pool_clears,
+            }
+
+
+class _LazyDatabase:
+    """Stands in for the Motor database until the client exists."""
+
+    def __init__(self, pool: "MongoPool"):
+        self._pool = pool
+
+    def __getitem__(self, name):
+        return self._pool.get_db()[name]
+
+    def __getattr__(self, attr):
+        return getattr(self._pool.get_db(), attr)
+
+
+class MongoPool:
+    """
+    One service's Motor client and database. Importing or building this needs
+    neither the URI nor a reachable server; the client is created on first
+    use and closed by close() (the next use reconnects). Extra keyword
+    arguments are passed to AsyncIOMotorClient.
+    """
+
+    def __init__(self, uri: Optional[str], db_name: str, **options):
+        self.uri = uri
+        self.db_name = db_name
+        self.max_pool_size = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+        self.min_pool_size = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+        self.max_idle_ms = int(os.getenv("MONGO_MAX_IDLE_MS", "0"))
+        self.wait_queue_timeout_ms = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+        self.compressors = os.getenv("MONGO_COMPRESSORS", "")
+        self.options = options
+        self.stats = PoolStats(self.max_pool_size, self.min_pool_size)
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db = _LazyDatabase(self)
+
+    def client_options(self) -> dict:
+        options = {
+            **self.options,
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "event_listeners": [self.stats],
+        }
+        if self.max_idle_ms > 0:
+            options["maxIdleTimeMS"] = self.max_idle_ms
+        if self.wait_queue_timeout_ms > 0:
+            options["waitQueueTimeoutMS"] = self.wait_queue_timeout_ms
+        if self.compressors:
+            options["compressors"] = self.compressors
+        return options
+
+    def get_client(self) -> AsyncIOMotorClient:
+        if self.client is None:
+            if not self.uri:
+                raise RuntimeError("MONGO_URI not set in .env")
+            self.client = AsyncIOMotorClient(self.uri, **self.client_options())
+        return self.client
+
+    def get_db(self):
+        return self.get_client()[self.db_name]
+
+    async def warm_pool(self, size: Optional[int] = None) -> int:
+        """
+        Open `size` connections now (default MONGO_MIN_POOL_SIZE; concurrent
+        pings, each checking out its own connection) instead of on the first
+        requests. Returns the open count.
+        """
+        size = self.min_pool_size if size is None else size
+        if size > 0:
+            await asyncio.gather(*(self.db.command("ping") for _ in range(size)))
+        return self.stats.snapshot()["open"]
+
+    def close(self):
+        """Close the Motor client (called on shutdown; the next use reconnects)."""
+        if self.client is None:
+            return
+        try:
+            self.client.close()
+        except Exception:
+            pass
+        self.client = None
+        self.stats.reset()
@@ -0,0 +1,152 @@
+# src/services/daily_batch.py
+"""
+Nightly emissions for every user with GPS data on a day, in a handful of
+round-trips instead of /calculate/daily's 3-5 per user:
+
+    1. one $group over the day's pings -> distance per user
+    2. rollups (then raw lat/lon, as a last resort) for users whose pings carry no distance_km
+    3. vehicles and user profiles fetched with $in
+    4. compute_co2_per_km once per (country, category, fuel, subregion)
+    5. one bulk_write of emissions upserts keyed on (user_id, date)
+
+Run it for a day from the python_vin_co2 folder:
+    python -m src.services.daily_batch [--date YYYY-MM-DD] [--country CC] [--subregion S]
+"""
+import argparse
+import asyncio
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+from pymongo import ReplaceOne
+
+from src.db import emissions_coll, users_coll, vehicles_coll
+from src.services import emission
+from src.services.gps_store import get_store
+
+# ids per $in query (keeps each query document well under Mongo's 16MB limit)
+IN_CHUNK = 5000
+# user ids reported per skip reason in the job summary
+MAX_REPORTED = 20
+
+
+def _chunks(items: List[str], size: int = IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _distances(day: str) -> Dict[str, float]:
+    """user_id -> km for the day: client distance_km, else lat/lon hops in timestamp order."""
+    store = get_store()
+    distances = await store.distance_totals(day)
+
+    missing = [u for u, km in distances.items() if km <= 0]
+    if not missing:
+        return distances
+
+    # no client distances: sum lat/lon hops like /calculate/daily does
+    def add_hops(user_id, docs):
+        from src.services import trajectory   # numpy only when clients send no distance
+        cols = trajectory.columns_from_docs(docs)
+        distances[user_id] += float(trajectory.hop_km(cols["lat"], cols["lon"]).sum())
+
+    for ids in _chunks(sorted(missing)):
+        current, docs = None, []
+        async for d in store.scan(day=day, user_ids=ids, fields=("lat", "lon")):
+            if d["user_id"] != current:
+                if docs:
+                    add_hops(current, docs)
+                current, docs = d["user_id"], []
+            docs.append(d)
+        if docs:
+            add_hops(current, docs)
+    return distances
+
+async def _fetch_by_user(coll, user_ids: List[str], projection: Optional[dict] = None) -> Dict[str, dict]:
+    found = {}
+    for ids in _chunks(user_ids):
+        async for d in coll.find({"user_id": {"$in": ids}}, projection):
+            found.setdefault(d["user_id"], d)
+    return found
+
+
+async def run_daily_batch(day: Optional[str] = None, country_code: Optional[str] = None, subregion: str = "") -> dict:
+    """
+    Compute and upsert the emissions record of every user with pings on `day`
+    (default today). country_code, when given, overrides the profile country
+    for every user, like the per-user endpoint.
+    """
+    day = day or date.today().isoformat()
+    started = time.perf_counter()
+    tables = emission.current_tables()   # loads the tables on first use; its version goes in the report
+
+    distances = await _distances(day)
+    user_ids = sorted(distances)
+    vehicles = await _fetch_by_user(vehicles_coll, user_ids, {"user_id": 1, "vin": 1, "vehicle_category": 1, "fuel_type": 1})
+    profiles = {}
+    if not country_code:
+        with_vehicle = [u for u in user_ids if u in vehicles]
+        profiles = await _fetch_by_user(users_coll, with_vehicle, {"user_id": 1, "country_code": 1, "country": 1})
+
+    skipped: Dict[str, List[str]] = {"no_distance": [], "no_vehicle": [], "no_country": [], "compute_failed": []}
+    memo: Dict[tuple, object] = {}
+    ops = []
+    for user_id in user_ids:
+        distance = distances[user_id]
+        if distance <= 0:
+            skipped["no_distance"].append(user_id)
+            continue
+        vehicle = vehicles.get(user_id)
+        if not vehicle:
+            skipped["no_vehicle"].append(user_id)
+            continue
+        profile = profiles.get(user_id) or {}
+        country = country_code or profile.get("country_code") or profile.get("country")
+        if not country:
+            skipped["no_country"].append(user_id)
+            continue
+
+        key = (country, vehicle.get("vehicle_category"), vehicle.get("fuel_type"), subregion)
+        if key not in memo:
+            try:
+                memo[key] = emission.compute_co2_per_km(*key)
+            except Exception as e:
+                memo[key] = e
+        res = memo[key]
+        if isinstance(res, Exception):
+            skipped["compute_failed"].append(user_id)
+            continue
+
+        # build_daily_record normalizes details in place, so every record gets its own copy
+        record = emission.build_daily_record(user_id, day, vehicle, distance, dict(res))
+        ops.append(ReplaceOne({"user_id": user_id, "date": day}, record, upsert=True))
+
+    written = 0
+    if ops:
+        result = await emissions_coll.bulk_write(ops, ordered=False)
+        written = result.upserted_count + result.modified_count
+
+    elapsed = time.perf_counter() - started
+    failures = {f"{k[0]}/{k[1]}/{k[2]}": str(v) for k, v in memo.items() if isinstance(v, Exception)}
+    return {
+        "ok": True,
+        "date": day,
+        "table_version": tables.version,
+        "users": len(user_ids),
+        "computed": len(ops),
+        "written": written,
+        "skipped": {reason: len(ids) for reason, ids in skipped.items()},
+        "skipped_sample": {reason: ids[:MAX_REPORTED] for reason, ids in skipped.items() if ids},
+        "compute_failures": failures,
+        "factor_lookups": len(memo),
+        "elapsed_s": round(elapsed, 3),
+        "users_per_sec": round(len(user_ids) / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute daily emissions for every user with GPS data")
+    parser.add_argument("--date", help="day to compute (YYYY-MM-DD, default today)")
+    parser.add_argument("--country", help="country_code for every user (default: from the user profile)")
+    parser.add_argument("--subregion", default="", help="grid subregion for electric vehicles")
+    args = parser.parse_args()
+    print(asyncio.run(run_daily_batch(day=args.date, country_code=args.country, subregion=args.subregion)))
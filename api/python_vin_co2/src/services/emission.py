@@ -1,42 +1,262 @@
 # src/services/emission.py
-from ..utils.excel_loader import load_grid_factors, load_fuel_factors, load_category_consumption
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import TYPE_CHECKING, NamedTuple, Mapping, Optional, Tuple
+from ..utils.excel_loader import load_all_tables, source_digest, source_stamp
 from ..utils.validators import normalize_fuel
-import pandas as pd
-
-# cached dfs
-_grid_df = None
-_fuel_df = None
-_cat_df = None
-
-def reload_tables():
-    global _grid_df, _fuel_df, _cat_df
-    _grid_df = load_grid_factors()
-    _fuel_df = load_fuel_factors()
-    _cat_df = load_category_consumption()
-
-def lookup_grid_factor(country_code: str, subregion: str = ""):
-    if _grid_df is None:
-        reload_tables()
+
+if TYPE_CHECKING:   # pandas is imported by excel_loader when the tables are first built
+    import pandas as pd
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class EmissionIndex(NamedTuple):
+    """
+    Read-only dict index over the emission tables, one mapping per lookup tier.
+    When a key appears on several rows the first row wins (same as df.iloc[0]).
+    """
+    grid_by_subregion: Mapping[Tuple[str, str], float]   # (country_code, subregion) -> kg/kWh
+    grid_by_country: Mapping[str, float]                 # country_code -> kg/kWh
+    fuel: Mapping[str, float]                            # fuel_type -> kg CO2 per unit
+    cons_exact: Mapping[Tuple[str, str, str], tuple]     # (country, category, fuel) -> (cons, unit)
+    cons_country_fuel: Mapping[Tuple[str, str], tuple]   # (country, fuel) -> (cons, unit)
+    cons_fuel: Mapping[str, tuple]                       # fuel -> (cons, unit)
+
+
+def build_index(grid_df, fuel_df, cat_df) -> EmissionIndex:
+    grid_sr, grid_cc, fuel = {}, {}, {}
+    exact, country_fuel, by_fuel = {}, {}, {}
+
+    for cc, sr, factor in grid_df[["country_code", "subregion", "grid_co2_kg_per_kwh"]].itertuples(index=False):
+        grid_sr.setdefault((cc, sr), float(factor))
+        grid_cc.setdefault(cc, float(factor))
+
+    for f, factor in fuel_df[["fuel_type", "kg_co2_per_unit"]].itertuples(index=False):
+        fuel.setdefault(f, float(factor))
+
+    cols = ["country_code", "vehicle_category", "fuel_type", "consumption_per_km", "unit"]
+    for cc, cat, f, cons, unit in cat_df[cols].itertuples(index=False):
+        value = (float(cons), unit)
+        exact.setdefault((cc, cat, f), value)
+        country_fuel.setdefault((cc, f), value)
+        by_fuel.setdefault(f, value)
+
+    return EmissionIndex(
+        grid_by_subregion=MappingProxyType(grid_sr),
+        grid_by_country=MappingProxyType(grid_cc),
+        fuel=MappingProxyType(fuel),
+        cons_exact=MappingProxyType(exact),
+        cons_country_fuel=MappingProxyType(country_fuel),
+        cons_fuel=MappingProxyType(by_fuel),
+    )
+
+class EmissionTables(NamedTuple):
+    """
+    One immutable, fully-built generation of the emission tables.
+    A reload builds a new instance and swaps the module reference in one
+    assignment, so a request that grabbed current_tables() keeps a
+    consistent view even if a reload lands mid-request.
+    """
+    version: str          # short content hash of the source spreadsheets
+    digest: str
+    loaded_at: datetime
+    grid_df: "pd.DataFrame"
+    fuel_df: "pd.DataFrame"
+    cat_df: "pd.DataFrame"
+    index: EmissionIndex
+
+
+# max compute_co2_per_km results kept (a few hundred combinations in practice)
+EMISSION_MEMO_SIZE = int(os.getenv("EMISSION_MEMO_SIZE", "2048"))
+# how long a "no data" (LookupError) answer is remembered
+EMISSION_MEMO_NEGATIVE_TTL_S = float(os.getenv("EMISSION_MEMO_NEGATIVE_TTL_S", "60"))
+
+def _memo_key(country_code, vehicle_category, fuel_norm, subregion) -> tuple:
+    fuel = (fuel_norm or "").upper().strip()
+    # the subregion only matters on the grid (electric) path
+    sr = (subregion or "").upper().strip() if fuel == "ELECTRIC" else ""
+    return ((country_code or "").upper().strip(), (vehicle_category or "").upper().strip(), fuel, sr)
+
+class _FactorMemo:
+    """
+    Bounded memo of compute_co2_per_km results for one table version. A
+    lookup with a different version (or a reload) empties it. LookupErrors
+    are kept for EMISSION_MEMO_NEGATIVE_TTL_S and re-raised on hit.
+    Reads take no lock (a dict get is atomic); when full the oldest entry
+    is dropped, which is rare with a few hundred distinct keys.
+    """
+    def __init__(self, max_size: int, negative_ttl_s: float):
+        self.max_size = max_size
+        self.negative_ttl_s = negative_ttl_s
+        self._version = None
+        self._data = {}   # key -> result dict | (expires_at, LookupError)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.invalidations = 0
+
+    def _reset(self, version):
+        if self._data:
+            self.invalidations += 1
+        self._data = {}
+        self._version = version
+
+    def get(self, version: str, key: tuple) -> Optional[dict]:
+        """The cached result, None on a miss; raises a cached LookupError."""
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._reset(version)
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if type(entry) is tuple:
+            expires_at, error = entry
+            if time.monotonic() >= expires_at:
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self.negative_hits += 1
+            raise type(error)(*error.args)
+        self.hits += 1
+        return entry
+
+    def _store(self, version: str, key: tuple, entry):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+            data = self._data
+            if key not in data and len(data) >= self.max_size:
+                data.pop(next(iter(data)), None)
+            data[key] = entry
+
+    def put(self, version: str, key: tuple, result: dict):
+        self._store(version, key, dict(result))
+
+    def put_error(self, version: str, key: tuple, error: LookupError):
+        if self.negative_ttl_s > 0:
+            self._store(version, key, (time.monotonic() + self.negative_ttl_s, error))
+
+    def clear(self):
+        with self._lock:
+            self._reset(None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "table_version": self._version,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+_memo = _FactorMemo(EMISSION_MEMO_SIZE, EMISSION_MEMO_NEGATIVE_TTL_S)
+
+def memo_stats() -> dict:
+    return _memo.stats()
+
+# currently active tables (None until first load)
+_tables: Optional[EmissionTables] = None
+_reload_lock = threading.Lock()
+
+def _build_tables() -> EmissionTables:
+    grid_df, fuel_df, cat_df, digest = load_all_tables()
+    return EmissionTables(
+        version=digest[:12],
+        digest=digest,
+        loaded_at=datetime.utcnow(),
+        grid_df=grid_df,
+        fuel_df=fuel_df,
+        cat_df=cat_df,
+        index=build_index(grid_df, fuel_df, cat_df),
+    )
+
+def reload_tables(force: bool = True) -> EmissionTables:
+    """
+    (Re)load the tables and atomically swap them in. With force=False the
+    spreadsheets are only re-read when their content hash changed.
+    Blocking (Excel parsing) - call reload_tables_async from async code.
+    """
+    global _tables
+    with _reload_lock:
+        current = _tables
+        if not force and current is not None and source_digest() == current.digest:
+            return current
+        new = _build_tables()
+        _tables = new
+        if current is None or current.digest != new.digest:
+            _memo.clear()
+    if current is None or current.digest != new.digest:
+        logger.info("emission tables now at version %s (was %s)", new.version, current.version if current else None)
+    return new
+
+async def reload_tables_async(force: bool = True) -> EmissionTables:
+    """Run reload_tables in a worker thread so the event loop never waits on Excel parsing."""
+    return await asyncio.to_thread(reload_tables, force)
+
+def current_tables() -> EmissionTables:
+    tables = _tables
+    if tables is None:
+        tables = reload_tables(force=False)
+    return tables
+
+async def watch_tables(interval_s: float):
+    """
+    Poll the source spreadsheets (mtime/size) every interval_s seconds and
+    hot-reload them when they change. Meant to run as a background task.
+    A failed reload (e.g. a half-written file) is retried on the next poll.
+    """
+    last = source_stamp()
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            stamp = source_stamp()
+            if stamp == last:
+                continue
+            await reload_tables_async(force=False)
+            last = stamp
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # keep serving the previous tables if the new files are broken
+            logger.exception("emission table hot reload failed; keeping version %s",
+                             _tables.version if _tables else None)
+
+def lookup_grid_factor(country_code: str, subregion: str = "", index: EmissionIndex = None):
+    idx = index if index is not None else current_tables().index
     cc = (country_code or "").upper().strip()
     sr = (subregion or "").upper().strip()
     # exact subregion match
-    df = _grid_df
-    row = df[(df["country_code"] == cc) & (df["subregion"] == sr)]
-    if not row.empty:
-        return float(row.iloc[0]["grid_co2_kg_per_kwh"])
+    factor = idx.grid_by_subregion.get((cc, sr))
+    if factor is not None:
+        return factor
     # country-level
-    row = df[df["country_code"] == cc]
-    if not row.empty:
-        return float(row.iloc[0]["grid_co2_kg_per_kwh"])
+    factor = idx.grid_by_country.get(cc)
+    if factor is not None:
+        return factor
     raise LookupError(f"No grid factor for {country_code}/{subregion}")
 
-def lookup_fuel_co2_per_unit(fuel_type: str):
-    if _fuel_df is None:
-        reload_tables()
+def lookup_fuel_co2_per_unit(fuel_type: str, index: EmissionIndex = None):
+    idx = index if index is not None else current_tables().index
     f = (fuel_type or "").upper().strip()
-    row = _fuel_df[_fuel_df["fuel_type"] == f]
-    if not row.empty:
-        return float(row.iloc[0]["kg_co2_per_unit"])
+    factor = idx.fuel.get(f)
+    if factor is not None:
+        return factor
     raise LookupError(f"No fuel emission factor for '{fuel_type}' (searched as '{f}')")
 
 
@@ -102,31 +322,26 @@ def lookup_fuel_co2_per_unit(fuel_type: str):
 
 
 
-def find_consumption(country_code: str, category: str, fuel_type: str):
-    if _cat_df is None:
-        reload_tables()
-    df = _cat_df
+def find_consumption(country_code: str, category: str, fuel_type: str, index: EmissionIndex = None):
+    idx = index if index is not None else current_tables().index
     cc = (country_code or "").upper().strip()
     cat = (category or "").upper().strip()
     f = (fuel_type or "").upper().strip()
 
     # try exact country + category + fuel
-    row = df[(df["country_code"] == cc) & (df["vehicle_category"] == cat) & (df["fuel_type"] == f)]
-    if not row.empty:
-        r = row.iloc[0]
-        return float(r["consumption_per_km"]), r.get("unit", "")
+    hit = idx.cons_exact.get((cc, cat, f))
+    if hit is not None:
+        return hit
 
     # fallback: country + fuel
-    row2 = df[(df["country_code"] == cc) & (df["fuel_type"] == f)]
-    if not row2.empty:
-        r = row2.iloc[0]
-        return float(r["consumption_per_km"]), r.get("unit", "")
+    hit = idx.cons_country_fuel.get((cc, f))
+    if hit is not None:
+        return hit
 
     # fallback: any country for that fuel
-    row3 = df[df["fuel_type"] == f]
-    if not row3.empty:
-        r = row3.iloc[0]
-        return float(r["consumption_per_km"]), r.get("unit", "")
+    hit = idx.cons_fuel.get(f)
+    if hit is not None:
+        return hit
 
     raise LookupError(f"No consumption data for {cc} / {cat} / {f}")
 
@@ -137,15 +352,32 @@ def compute_co2_per_km(country_code: str, vehicle_category: str, fuel_type: str,
       consumption_per_km, consumption_unit,
       kg_co2_per_unit,        # kg CO2 per unit (e.g. per litre)
       kg_co2_per_km,          # kg CO2 per km (consumption_per_km * kg_co2_per_unit)
-      method, details...
+      method, table_version, details...
     }
+    Results are memoized per table version (see _FactorMemo); every call
+    gets its own copy, so callers may modify it.
     """
+    # resolve every lookup against one generation of the tables
+    tables = current_tables()
     fuel_norm = normalize_fuel(fuel_type)
-    cons, unit = find_consumption(country_code, vehicle_category, fuel_norm)
+    key = _memo_key(country_code, vehicle_category, fuel_norm, subregion)
+    res = _memo.get(tables.version, key)
+    if res is None:
+        try:
+            res = _compute_co2_per_km(tables, country_code, vehicle_category, fuel_norm, subregion)
+        except LookupError as e:
+            _memo.put_error(tables.version, key, e)
+            raise
+        _memo.put(tables.version, key, res)
+    return dict(res)
+
+def _compute_co2_per_km(tables: EmissionTables, country_code: str, vehicle_category: str, fuel_norm: str, subregion: str = ""):
+    idx = tables.index
+    cons, unit = find_consumption(country_code, vehicle_category, fuel_norm, index=idx)
 
     # Electric vehicles use grid
     if fuel_norm == "ELECTRIC":
-        grid = lookup_grid_factor(country_code, subregion)
+        grid = lookup_grid_factor(country_code, subregion, index=idx)
         kg_per_km = cons * grid
         return {
             "consumption_per_km": cons,
@@ -153,11 +385,12 @@ def compute_co2_per_km(country_code: str, vehicle_category: str, fuel_type: str,
             "kg_co2_per_unit": grid,    # here unit is kWh so this is kgCO2 per kWh
             "kg_co2_per_km": kg_per_km,
             "grid_kg_co2_per_kwh": grid,
-            "method": "electric_grid"
+            "method": "electric_grid",
+            "table_version": tables.version
         }
 
     # Fuel chemistry path
-    co2_per_unit = lookup_fuel_co2_per_unit(fuel_norm)  # kg CO2 per litre (or per unit)
+    co2_per_unit = lookup_fuel_co2_per_unit(fuel_norm, index=idx)  # kg CO2 per litre (or per unit)
     # co2_per_unit is kg CO2 per 1 unit (e.g. 1 L)
     kg_per_km = cons * co2_per_unit
 
@@ -166,5 +399,72 @@ def compute_co2_per_km(country_code: str, vehicle_category: str, fuel_type: str,
         "consumption_unit": unit,
         "kg_co2_per_unit": co2_per_unit,
         "kg_co2_per_km": kg_per_km,
-        "method": "fuel_chemistry"
+        "method": "fuel_chemistry",
+        "table_version": tables.version
+    }
+
+
+def _safe_float(v, default=None):
+    try:
+        f = float(v)
+        if math.isnan(f):
+            return default
+        return f
+    except Exception:
+        return default
+
+def build_daily_record(user_id: str, day: str, vehicle: dict, distance_km: float, res: dict) -> dict:
+    """
+    The emissions document for one user-day, from the vehicle, the day's
+    distance and a compute_co2_per_km result. `res` is normalized in place
+    (canonical kg_co2_per_* keys, NaN -> None) and stored as `details`.
+    """
+    # compute_co2_per_km may return keys named differently depending on loader:
+    # - kg_co2_per_unit (or) co2_kg_per_unit  <-- per fuel unit (kg per litre, or kg per kg)
+    # - kg_co2_per_km   (or) co2_kg_per_km   <-- per km (already multiplied)
+    # - consumption_per_km, consumption_unit
+    kg_co2_per_unit = res.get("kg_co2_per_unit") or res.get("co2_kg_per_unit")
+    kg_co2_per_km = res.get("kg_co2_per_km") or res.get("co2_kg_per_km")
+
+    # try to compute kg_co2_per_km if missing using consumption_per_km * kg_co2_per_unit
+    if kg_co2_per_km is None:
+        cons = res.get("consumption_per_km")
+        if cons is not None and (kg_co2_per_unit is not None):
+            try:
+                kg_co2_per_km = float(cons) * float(kg_co2_per_unit)
+            except Exception:
+                kg_co2_per_km = None
+
+    # sanitize numeric values (convert NaN to None)
+    kg_co2_per_unit_f = _safe_float(kg_co2_per_unit, default=None)
+    kg_co2_per_km_f = _safe_float(kg_co2_per_km, default=None)
+
+    # If nothing could be computed, set numeric results to 0.0 (avoid NaN JSON errors)
+    if kg_co2_per_km_f is None:
+        kg_co2_per_km_f = 0.0
+
+    total_kg = float(distance_km) * kg_co2_per_km_f
+
+    # Make sure details contain canonical keys (helpful for clients)
+    if "kg_co2_per_unit" not in res and kg_co2_per_unit_f is not None:
+        res["kg_co2_per_unit"] = kg_co2_per_unit_f
+    if "kg_co2_per_km" not in res:
+        res["kg_co2_per_km"] = kg_co2_per_km_f
+
+    # convert any NaN float entries inside res to None to avoid JSON errors
+    for k, v in list(res.items()):
+        if isinstance(v, float) and math.isnan(v):
+            res[k] = None
+
+    return {
+        "user_id": user_id,
+        "date": day,
+        "vehicle": {"vin": vehicle.get("vin"), "vehicle_category": vehicle.get("vehicle_category"), "fuel_type": vehicle.get("fuel_type")},
+        "distance_km": float(distance_km),
+        "co2_kg_per_unit": kg_co2_per_unit_f if kg_co2_per_unit_f is not None else 0.0,
+        "co2_kg_per_km": kg_co2_per_km_f,
+        "total_kg_co2": total_kg,
+        "details": res,
+        "table_version": res.get("table_version"),
+        "created_at": datetime.utcnow().isoformat()
     }
@@ -1,15 +1,49 @@
 # src/services/gemini_ocr.py
+import asyncio
 import base64
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 from dotenv import load_dotenv
-from google import genai
+
+from . import local_ocr
+from ..utils.image_prep import prepare_vin_image
+from ..utils.validators import extract_vin_from_text
 
 load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise RuntimeError("GEMINI_API_KEY not set")
 
-client = genai.Client(api_key=API_KEY)
+# GEMINI_BASE_URL points the SDK at another endpoint (e.g. a local stub for benchmarks)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """The Gemini client, created on the first OCR call (the SDK is slow to import)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not API_KEY:
+                    raise RuntimeError("GEMINI_API_KEY not set")
+                from google import genai
+                _client = genai.Client(
+                    api_key=API_KEY,
+                    http_options={"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+                )
+    return _client
+
+# OCR calls are blocking SDK calls, so they run on a small dedicated pool
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "4"))   # OCR calls running at once
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "8"))               # uploads allowed to wait for a slot
+OCR_TIMEOUT_S = float(os.getenv("OCR_TIMEOUT_S", "30"))
+
+
+class OcrBusyError(RuntimeError):
+    """Raised when the OCR pool and its wait queue are full (callers should answer 429)."""
+
 
 def extract_text_from_image_gemini(image_bytes: bytes, mime_type: str = "image/jpeg") -> str:
     b64 = base64.b64encode(image_bytes).decode()
@@ -17,5 +51,85 @@ def extract_text_from_image_gemini(image_bytes: bytes, mime_type: str = "image/j
         {"role":"user","parts":[{"inlineData":{"mimeType":mime_type,"data":b64}}]},
         {"role":"user","parts":[{"text":"Extract all alphanumeric text from the image. Return plain text only."}]}
     ]
-    resp = client.models.generate_content(model="gemini-2.0-flash", contents=contents)
+    resp = get_client().models.generate_content(model="gemini-2.0-flash", contents=contents)
     return (resp.text or "").strip()
+
+
+_executor = ThreadPoolExecutor(max_workers=OCR_MAX_CONCURRENCY, thread_name_prefix="ocr")
+_in_flight = 0   # submitted calls whose thread has not finished yet (running + waiting)
+_ocr_backend: Callable[[bytes, str], str] = extract_text_from_image_gemini
+_local_backend = local_ocr.get_backend()
+
+# pipeline counters (updated from the pool threads)
+_counters_lock = threading.Lock()
+_counters = {"images": 0, "bytes_in": 0, "bytes_sent": 0, "local_hits": 0, "remote_calls": 0}
+
+def set_ocr_backend(fn: Callable[[bytes, str], str]):
+    """Swap the blocking remote OCR function (e.g. a fake slow backend in tests/benchmarks)."""
+    global _ocr_backend
+    _ocr_backend = fn
+
+def set_local_backend(fn):
+    """Swap (or disable with None) the local OCR backend tried before the remote call."""
+    global _local_backend
+    _local_backend = fn
+
+def _count(**deltas):
+    with _counters_lock:
+        for k, v in deltas.items():
+            _counters[k] += v
+
+def ocr_stats() -> dict:
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        "in_flight": _in_flight,
+        "max_concurrency": OCR_MAX_CONCURRENCY,
+        "max_queue": OCR_MAX_QUEUE,
+        "timeout_s": OCR_TIMEOUT_S,
+        **counters,
+    }
+
+def _ocr_pipeline(image_bytes: bytes, mime_type: str) -> str:
+    """
+    Blocking OCR pipeline (runs on the pool): shrink the image, try the local
+    backend and only call the remote backend when no valid VIN came back.
+    """
+    data, mime = prepare_vin_image(image_bytes, mime_type)
+    _count(images=1, bytes_in=len(image_bytes))
+
+    if _local_backend is not None:
+        try:
+            text = _local_backend(data, mime) or ""
+        except Exception as e:
+            print("Warning: local OCR failed, falling back to remote:", repr(e))
+            text = ""
+        if extract_vin_from_text(text):
+            _count(local_hits=1)
+            return text
+
+    _count(remote_calls=1, bytes_sent=len(data))
+    return _ocr_backend(data, mime)
+
+def _release(fut):
+    global _in_flight
+    _in_flight -= 1
+    if not fut.cancelled():
+        fut.exception()  # mark as retrieved when the caller already timed out
+
+async def extract_text_async(image_bytes: bytes, mime_type: str = "image/jpeg") -> str:
+    """
+    Run the OCR pipeline on the bounded thread pool without blocking the event loop.
+    Raises OcrBusyError when OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE calls are already
+    in flight, and asyncio.TimeoutError after OCR_TIMEOUT_S.
+    """
+    global _in_flight
+    if _in_flight >= OCR_MAX_CONCURRENCY + OCR_MAX_QUEUE:
+        raise OcrBusyError("OCR is busy, retry shortly")
+    loop = asyncio.get_running_loop()
+    fut = loop.run_in_executor(_executor, _ocr_pipeline, image_bytes, mime_type)
+    _in_flight += 1
+    # a timed-out call keeps its thread until the SDK returns, so the slot is
+    # only released when the thread really finishes
+    fut.add_done_callback(_release)
+    return await asyncio.wait_for(asyncio.shield(fut), OCR_TIMEOUT_S)
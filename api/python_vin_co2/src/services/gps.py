@@ -272,15 +272,31 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from datetime import datetime, timezone, date
+from collections import deque
+import asyncio
 import math
 import io
 import csv
 
-from src.db import gps_coll
 from pymongo.errors import ServerSelectionTimeoutError
+from src.services.gps_store import get_store
+from src.services.ping_cache import RecentSpeedCache
+from src.services import rollups
+from src.services.write_behind import WriteBehindFullError, queue as write_behind
 
 router = APIRouter(prefix="/gps", tags=["gps"])
 
+# number of previous samples used to smooth the real-time mode prediction (tunable)
+RECENT_PINGS = 4
+# upper bound on pings accepted by one /gps/update/batch call
+GPS_BATCH_MAX = int(os.getenv("GPS_BATCH_MAX", "1000"))
+# documents per Mongo cursor batch / CSV rows per streamed chunk for the daily-modes endpoints
+GPS_CURSOR_BATCH = int(os.getenv("GPS_CURSOR_BATCH", "1000"))
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "500"))
+
+# per-worker LRU of each user's last RECENT_PINGS speeds (skips the history read on a hit)
+recent_speeds = RecentSpeedCache(depth=RECENT_PINGS)
+
 # --- helpers ---
 def parse_iso(ts: Optional[str]) -> datetime:
     if not ts:
@@ -330,80 +346,346 @@ class GpsUpdate(BaseModel):
     distance_km: Optional[float] = None
     timestamp_iso: Optional[str] = None
 
-# POST /gps/update - canonical single implementation with real-time mode prediction
-@router.post("/update")
-async def gps_update(payload: GpsUpdate):
+def _build_doc(payload: GpsUpdate) -> dict:
     ts = parse_iso(payload.timestamp_iso)
-    doc_date = ts.date().isoformat()
-
-    # Build base doc
-    doc = {
+    return {
         "user_id": payload.user_id,
         "lat": payload.lat,
         "lon": payload.lon,
         "speed_kmh": float(payload.speed_kmh) if payload.speed_kmh is not None else None,
         "distance_km": float(payload.distance_km) if payload.distance_km is not None else None,
         "timestamp": ts,
-        "date": doc_date,
+        "date": ts.date().isoformat(),
         "inserted_at": datetime.utcnow()
     }
 
-    # ------------------------
-    # Real-time mode prediction
-    # ------------------------
-    # 1) Fetch recent N records (most recent first), exclude the current one
-    N = 4  # number of previous samples to use (tunable)
+def _stored_view(doc: dict) -> dict:
+    return {
+        "user_id": doc["user_id"],
+        "lat": doc["lat"],
+        "lon": doc["lon"],
+        "speed_kmh": doc["speed_kmh"],
+        "distance_km": doc["distance_km"],
+        "timestamp": doc["timestamp"].isoformat(),
+        "date": doc["date"],
+        "inferred_mode": doc["inferred_mode"],
+        "_id": str(doc["_id"])
+    }
+
+async def _recent_speeds(user_id: str, n: int = RECENT_PINGS) -> List[float]:
+    """Speeds of the user's last n stored pings, oldest first (missing speeds count as 0.0)."""
+    if recent_speeds.enabled:
+        cached = recent_speeds.get(user_id)
+        if cached is not None:
+            return cached[-n:]
     try:
-        cursor = gps_coll.find({"user_id": payload.user_id}).sort("timestamp", -1).limit(N)
-        recent_docs = await cursor.to_list(length=N)
+        recent_docs = await get_store().recent(user_id, n)
     except Exception as e:
         # if DB read fails, continue without recent smoothing (we'll still try to store current ping)
         print("Warning: failed to fetch recent pings for smoothing:", repr(e))
-        recent_docs = []
-
-    # 2) Build speed time-series in chronological order
-    speeds: List[float] = []
+        return []
     # recent_docs is most-recent-first so reverse it
-    for r in reversed(recent_docs):
-        s = r.get("speed_kmh")
-        if s is None:
-            # Try compute from distance if present and timestamp present and previous exists — skip complex computation here
-            speeds.append(0.0)
-        else:
-            speeds.append(float(s))
-    # Append current ping's speed (use 0.0 if missing)
-    current_speed = float(payload.speed_kmh) if payload.speed_kmh is not None else 0.0
-    speeds.append(current_speed)
+    speeds = [float(r["speed_kmh"]) if r.get("speed_kmh") is not None else 0.0 for r in reversed(recent_docs)]
+    recent_speeds.fill(user_id, speeds)
+    return speeds
+
+def _predict_modes(history: List[float], new_speeds: List[float], n: int = RECENT_PINGS) -> List[str]:
+    """
+    Real-time mode for each new ping, in order: each ping is smoothed together
+    with the n samples that preceded it (history first, then earlier pings of
+    the same batch) and the last smoothed value decides the mode.
+    """
+    series = list(history) + list(new_speeds)
+    offset = len(history)
+    modes = []
+    for j in range(offset, len(series)):
+        smoothed = smooth_speeds(series[max(0, j - n):j + 1], window=3)
+        modes.append(infer_mode_from_speed(smoothed[-1]))
+    return modes
+
+def _enqueue(items):
+    """Hand pings to the write-behind queue (GPS_WRITE_BEHIND=1); 429 when it is full."""
+    try:
+        write_behind.submit(items)
+    except WriteBehindFullError:
+        raise HTTPException(status_code=429, detail="GPS ingest queue is full, please retry shortly", headers={"Retry-After": "1"})
+
+# POST /gps/update - canonical single implementation with real-time mode prediction
+@router.post("/update")
+async def gps_update(payload: GpsUpdate):
+    # Build base doc
+    doc = _build_doc(payload)
 
-    # 3) Smooth speeds and infer mode using last smoothed value
-    smoothed = smooth_speeds(speeds, window=3)
-    predicted_mode = infer_mode_from_speed(smoothed[-1]) if smoothed else infer_mode_from_speed(current_speed)
+    # ------------------------
+    # Real-time mode prediction
+    # ------------------------
+    # Smooth the last RECENT_PINGS stored speeds + this ping's speed (0.0 if missing)
+    history = await _recent_speeds(payload.user_id)
+    current_speed = doc["speed_kmh"] if doc["speed_kmh"] is not None else 0.0
+    doc["inferred_mode"] = _predict_modes(history, [current_speed])[0]
 
-    # Attach prediction to doc
-    doc["inferred_mode"] = predicted_mode
+    if write_behind.running:
+        _enqueue([doc])
+        recent_speeds.push(payload.user_id, current_speed)
+        return {"ok": True, "queued": True, "stored": _stored_view(doc)}
 
     # Insert doc, handle DB failures gracefully
     try:
-        res = await gps_coll.insert_one(doc)
-        doc["_id"] = res.inserted_id
+        errors = await get_store().insert([doc])
     except ServerSelectionTimeoutError as e:
         print("DB timeout while inserting gps ping:", repr(e))
         raise HTTPException(status_code=503, detail="Database unavailable (timeout)")
     except Exception as e:
         print("DB insert failed:", repr(e))
         raise HTTPException(status_code=503, detail="Database unavailable")
+    if errors:
+        print("DB insert failed:", errors[0])
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    recent_speeds.push(payload.user_id, current_speed)
+    await rollups.record_pings([doc])
 
     # Return stored doc and prediction
-    return {"ok": True, "stored": {
-        "user_id": doc["user_id"],
-        "lat": doc["lat"],
-        "lon": doc["lon"],
-        "speed_kmh": doc["speed_kmh"],
-        "distance_km": doc["distance_km"],
-        "timestamp": doc["timestamp"].isoformat(),
-        "date": doc["date"],
-        "inferred_mode": doc["inferred_mode"],
-        "_id": str(doc["_id"])
-    }}
+    return {"ok": True, "stored": _stored_view(doc)}
+
+# POST /gps/update/batch - ordered array of buffered pings (one or many users)
+@router.post("/update/batch")
+async def gps_update_batch(pings: List[GpsUpdate]):
+    if not pings:
+        raise HTTPException(status_code=400, detail="No pings provided")
+    if len(pings) > GPS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many pings in one batch (max {GPS_BATCH_MAX})")
+
+    docs = [_build_doc(p) for p in pings]
+
+    # group batch positions per user, keeping the client's order
+    by_user: Dict[str, List[int]] = {}
+    for i, doc in enumerate(docs):
+        by_user.setdefault(doc["user_id"], []).append(i)
+
+    # one history read per user, issued concurrently
+    users = list(by_user)
+    histories = await asyncio.gather(*(_recent_speeds(u) for u in users))
+
+    for user_id, history in zip(users, histories):
+        positions = by_user[user_id]
+        speeds = [docs[i]["speed_kmh"] if docs[i]["speed_kmh"] is not None else 0.0 for i in positions]
+        for i, mode in zip(positions, _predict_modes(history, speeds)):
+            docs[i]["inferred_mode"] = mode
+
+    if write_behind.running:
+        _enqueue(docs)
+        for doc in docs:
+            recent_speeds.push(doc["user_id"], doc["speed_kmh"] if doc["speed_kmh"] is not None else 0.0)
+        return {
+            "ok": True,
+            "received": len(docs),
+            "queued": len(docs),
+            "inserted": 0,
+            "failed": 0,
+            "results": [{"index": i, "ok": True, **_stored_view(doc)} for i, doc in enumerate(docs)]
+        }
+
+    # single unordered bulk write; every doc gets its _id before sending
+    try:
+        errors = await get_store().insert(docs)
+    except ServerSelectionTimeoutError as e:
+        print("DB timeout while inserting gps batch:", repr(e))
+        raise HTTPException(status_code=503, detail="Database unavailable (timeout)")
+    except Exception as e:
+        print("DB batch insert failed:", repr(e))
+        raise HTTPException(status_code=503, detail="Database unavailable")
+
+    results = []
+    stored = []
+    for i, doc in enumerate(docs):
+        if i in errors:
+            results.append({"index": i, "ok": False, "user_id": doc["user_id"], "error": errors[i]})
+        else:
+            recent_speeds.push(doc["user_id"], doc["speed_kmh"] if doc["speed_kmh"] is not None else 0.0)
+            stored.append(doc)
+            results.append({"index": i, "ok": True, **_stored_view(doc)})
+    await rollups.record_pings(stored)
+
+    return {
+        "ok": not errors,
+        "received": len(docs),
+        "inserted": len(docs) - len(errors),
+        "failed": len(errors),
+        "results": results
+    }
+
 
+# --- daily mode summary / export (streamed, constant memory) ---
+
+class _DayModeStream:
+    """
+    Folds one user-day of pings (in timestamp order) into per-mode totals
+    without keeping the day in memory. Each ping's smoothed speed needs the
+    window//2 pings after it, so pings come back out of push() that many
+    pings late and the tail comes out of finish(). Missing speeds count as
+    0 and a ping without distance_km gets the haversine hop from the
+    previous ping, as before.
+    """
+    def __init__(self, window: int = 3):
+        self.half = window // 2 if window > 1 else 0
+        self._pending = deque()   # (doc, km, speed) not emitted yet
+        self._speeds = deque()    # speeds from index _base on (window of the next emitted ping)
+        self._base = 0            # absolute index of _speeds[0]
+        self._next = 0            # absolute index of the next ping to emit
+        self._count = 0
+        self._prev_latlon = None
+        self.total_km = 0.0
+        self.by_mode: Dict[str, float] = {}
+
+    @property
+    def records_count(self) -> int:
+        return self._count
+
+    def _segment_km(self, doc: dict) -> float:
+        latlon = (doc.get("lat"), doc.get("lon"))
+        prev, self._prev_latlon = self._prev_latlon, latlon
+        if doc.get("distance_km") is not None:
+            return float(doc["distance_km"])
+        if prev is None or None in prev or None in latlon:
+            return 0.0
+        return haversine_km(prev[0], prev[1], latlon[0], latlon[1])
+
+    def _emit(self, last: int):
+        """Emit the oldest pending ping; `last` is the highest index whose speed is known."""
+        doc, km, speed = self._pending.popleft()
+        i = self._next
+        lo, hi = max(0, i - self.half), min(last, i + self.half)
+        window = [self._speeds[j - self._base] for j in range(lo, hi + 1)]
+        smoothed = sum(window) / len(window)
+        mode = infer_mode_from_speed(smoothed)
+        self.by_mode[mode] = self.by_mode.get(mode, 0.0) + km
+        self.total_km += km
+        self._next += 1
+        while self._base < self._next - self.half:
+            self._speeds.popleft()
+            self._base += 1
+        return doc, km, speed, mode
+
+    def push(self, doc: dict) -> list:
+        """Add the next ping; returns the pings that are now complete as (doc, km, speed, mode)."""
+        speed = float(doc["speed_kmh"]) if doc.get("speed_kmh") is not None else 0.0
+        self._pending.append((doc, self._segment_km(doc), speed))
+        self._speeds.append(speed)
+        self._count += 1
+        out = []
+        while len(self._pending) > self.half:
+            out.append(self._emit(self._count - 1))
+        return out
+
+    def finish(self) -> list:
+        out = []
+        while self._pending:
+            out.append(self._emit(self._count - 1))
+        return out
+
+
+def _parse_day(day: Optional[str]) -> str:
+    if day:
+        try:
+            return date.fromisoformat(day).isoformat()
+        except Exception:
+            raise HTTPException(status_code=400, detail="day must be ISO date YYYY-MM-DD")
+    return datetime.utcnow().date().isoformat()
+
+def _day_cursor(user_id: str, iso_day: str, fields):
+    return get_store().scan(day=iso_day, user_id=user_id, fields=fields, batch_size=GPS_CURSOR_BATCH)
+
+# GET /gps/daily-modes - summary by inferred mode
+@router.get("/daily-modes")
+async def gps_daily_modes(user_id: str, day: Optional[str] = None):
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id required")
+    iso_day = _parse_day(day)
+
+    stream = _DayModeStream(window=3)
+    async for d in _day_cursor(user_id, iso_day, ("lat", "lon", "speed_kmh", "distance_km")):
+        stream.push(d)
+    stream.finish()
+
+    if not stream.records_count:
+        return {"ok": True, "date": iso_day, "user_id": user_id, "total_km": 0.0, "by_mode": {}}
+
+    ordered = {k: round(v, 4) for k, v in sorted(stream.by_mode.items(), key=lambda kv: kv[0])}
+    return {
+        "ok": True,
+        "user_id": user_id,
+        "date": iso_day,
+        "total_km": round(stream.total_km, 4),
+        "by_mode": ordered,
+        "records_count": stream.records_count
+    }
 
+# GET /gps/daily-modes/export - CSV streaming export
+@router.get("/daily-modes/export")
+async def gps_daily_modes_export(user_id: str, day: Optional[str] = None):
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id required")
+    iso_day = _parse_day(day)
+
+    async def csv_generator():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        def take():
+            chunk = buf.getvalue()
+            buf.seek(0); buf.truncate(0)
+            return chunk
+
+        header = ["record_id", "timestamp", "date", "user_id", "lat", "lon", "speed_kmh", "distance_km", "inferred_mode"]
+        writer.writerow(header)
+        yield take()
+
+        def write_rows(rows):
+            for d, km, spd, mode in rows:
+                ts = d.get("timestamp")
+                writer.writerow([
+                    str(d.get("_id") or ""),
+                    ts.isoformat() if isinstance(ts, datetime) else parse_iso(ts).isoformat(),
+                    iso_day,
+                    user_id,
+                    d["lat"] if d.get("lat") is not None else "",
+                    d["lon"] if d.get("lon") is not None else "",
+                    round(spd, 3),
+                    round(km, 6),
+                    mode
+                ])
+
+        stream = _DayModeStream(window=3)
+        pending_rows = 0
+        async for d in _day_cursor(user_id, iso_day, ("lat", "lon", "speed_kmh", "distance_km", "timestamp")):
+            rows = stream.push(d)
+            write_rows(rows)
+            pending_rows += len(rows)
+            if pending_rows >= CSV_CHUNK_ROWS:
+                yield take()
+                pending_rows = 0
+        write_rows(stream.finish())
+
+        if not stream.records_count:
+            writer.writerow([])
+            writer.writerow(["SUMMARY"])
+            writer.writerow(["date", "user_id", "total_km", "records_count", "exported_at"])
+            writer.writerow([iso_day, user_id, 0.0, 0, datetime.utcnow().isoformat()])
+            yield take()
+            return
+
+        writer.writerow([])
+        writer.writerow(["SUMMARY"])
+        writer.writerow(["date", "user_id", "total_km", "records_count", "exported_at"])
+        writer.writerow([iso_day, user_id, round(stream.total_km, 6), stream.records_count, datetime.utcnow().isoformat()])
+        writer.writerow([])
+        writer.writerow(["MODE_BREAKDOWN"])
+        writer.writerow(["mode", "km"])
+        for m, v in stream.by_mode.items():
+            writer.writerow([m, round(v, 6)])
+        yield take()
+
+    filename = f"gps_export_{user_id}_{iso_day}.csv"
+    return StreamingResponse(csv_generator(), media_type="text/csv", headers={
+        "Content-Disposition": f"attachment; filename={filename}"
+    })
@@ -0,0 +1,289 @@
+# src/services/gps_store.py
+"""
+Storage layouts for GPS pings, selected with GPS_STORAGE:
+
+    document (default)  one gps_logs document per ping
+    bucket              one gps_buckets document per user-hour (UTC) holding
+                        parallel arrays (timestamp, lat, lon, speed_kmh,
+                        distance_km, inferred_mode); user_id/date are stored
+                        once per bucket and there is no per-ping _id or index
+                        entry
+
+Every read and write of pings goes through get_store(), so both layouts
+answer the same calls with the same ping dicts. Move existing data between
+them with:
+    python -m src.services.gps_store migrate --to bucket [--date YYYY-MM-DD] [--user USER_ID]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from src import db
+
+GPS_STORAGE = os.getenv("GPS_STORAGE", "document").strip().lower()
+
+# per-ping fields both layouts store
+PING_FIELDS = ("timestamp", "lat", "lon", "speed_kmh", "distance_km", "inferred_mode")
+
+
+def _stored_clock(ts):
+    """
+    A timestamp as Mongo gives it back: naive UTC, millisecond precision.
+    Bucket hours and ping ids use this clock, so a ping gets the same bucket
+    and id whether it comes from a client (tz-aware) or from Mongo (migrate).
+    """
+    if not isinstance(ts, datetime):
+        return ts
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+
+def _scope(day: Optional[str] = None, user_id: Optional[str] = None, user_ids: Optional[List[str]] = None) -> dict:
+    query = {}
+    if day:
+        query["date"] = day
+    if user_id:
+        query["user_id"] = user_id
+    elif user_ids is not None:
+        query["user_id"] = {"$in": list(user_ids)}
+    return query
+
+
+class DocumentStore:
+    """One gps_logs document per ping (the original layout)."""
+    layout = "document"
+
+    def __init__(self, coll):
+        self.coll = coll
+
+    @staticmethod
+    def assign_id(doc: dict):
+        doc.setdefault("_id", ObjectId())
+
+    async def insert(self, docs: List[dict]) -> Dict[int, str]:
+        """
+        Store pings (each gets its _id set). Returns {index: error} for pings
+        the server rejected; other failures (timeouts...) are raised.
+        """
+        errors = {}
+        if len(docs) == 1:
+            await self.coll.insert_one(docs[0])
+            return errors
+        try:
+            await self.coll.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                errors[err["index"]] = err.get("errmsg", "write failed")
+        return errors
+
+    async def recent(self, user_id: str, n: int) -> List[dict]:
+        """The user's last n pings, newest first (speed_kmh only)."""
+        cursor = self.coll.find({"user_id": user_id}, {"speed_kmh": 1}).sort("timestamp", -1).limit(n)
+        return await cursor.to_list(length=n)
+
+    async def distance_totals(self, day: str, user_id: Optional[str] = None) -> Dict[str, float]:
+        """{user_id: sum of client distance_km} for the day."""
+        cursor = self.coll.aggregate([
+            {"$match": _scope(day, user_id)},
+            {"$group": {"_id": "$user_id", "total": {"$sum": "$distance_km"}}}
+        ], allowDiskUse=True)
+        return {r["_id"]: float(r.get("total") or 0.0) async for r in cursor if r["_id"] is not None}
+
+    async def count(self, day: str, user_id: str) -> int:
+        """Number of stored pings for one user-day."""
+        return await self.coll.count_documents(_scope(day, user_id))
+
+    async def scan(self, day: Optional[str] = None, user_id: Optional[str] = None, user_ids: Optional[List[str]] = None,
+                   fields: Iterable[str] = PING_FIELDS, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Pings in (user_id, date, timestamp) order, with user_id, date, _id and `fields`."""
+        projection = {f: 1 for f in ("user_id", "date", *fields)}
+        cursor = self.coll.find(_scope(day, user_id, user_ids), projection)
+        cursor = cursor.sort([("user_id", 1), ("date", 1), ("timestamp", 1)]).batch_size(batch_size)
+        async for d in cursor:
+            yield d
+
+    async def delete(self, day: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        return (await self.coll.delete_many(_scope(day, user_id))).deleted_count
+
+
+class BucketStore:
+    """One gps_buckets document per user-hour with parallel per-ping arrays."""
+    layout = "bucket"
+
+    def __init__(self, coll):
+        self.coll = coll
+
+    @staticmethod
+    def bucket_id(doc: dict) -> str:
+        # UTC hour of the ping within its (client-local) `date`
+        return f"{doc['user_id']}|{doc['date']}T{_stored_clock(doc['timestamp']).hour:02d}"
+
+    @staticmethod
+    def ping_id(user_id: str, ts) -> str:
+        """Pings have no _id in this layout; user + stored (UTC, ms) timestamp identifies one."""
+        ts = _stored_clock(ts)
+        return f"{user_id}|{ts.isoformat() if hasattr(ts, 'isoformat') else ts}"
+
+    @classmethod
+    def assign_id(cls, doc: dict):
+        doc["_id"] = cls.ping_id(doc["user_id"], doc["timestamp"])
+
+    async def insert(self, docs: List[dict]) -> Dict[int, str]:
+        groups: Dict[str, List[int]] = {}
+        for i, doc in enumerate(docs):
+            self.assign_id(doc)
+            groups.setdefault(self.bucket_id(doc), []).append(i)
+
+        ops = []
+        now = datetime.utcnow()
+        for bucket_id, positions in groups.items():
+            pings = [docs[i] for i in positions]
+            first = pings[0]
+            timestamps = [p["timestamp"] for p in pings]
+            ops.append(UpdateOne({"_id": bucket_id}, {
+                "$setOnInsert": {"user_id": first["user_id"], "date": first["date"], "hour": bucket_id.rsplit("|", 1)[1]},
+                "$push": {f: {"$each": [p.get(f) for p in pings]} for f in PING_FIELDS},
+                "$inc": {"n": len(pings)},
+                "$min": {"first_ts": min(timestamps)},
+                "$max": {"last_ts": max(timestamps)},
+                "$set": {"updated_at": now}
+            }, upsert=True))
+
+        errors = {}
+        try:
+            await self.coll.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            bucket_ids = list(groups)
+            for err in e.details.get("writeErrors", []):
+                for i in groups[bucket_ids[err["index"]]]:
+                    errors[i] = err.get("errmsg", "write failed")
+        return errors
+
+    @staticmethod
+    def _unpack(bucket: dict, fields: Iterable[str]) -> List[dict]:
+        """Bucket -> ping dicts in timestamp order (arrays are in arrival order)."""
+        ts = bucket.get("timestamp") or []
+        columns = {f: bucket.get(f) or [] for f in fields}
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        pings = []
+        for i in order:
+            p = {"user_id": bucket["user_id"], "date": bucket["date"], "_id": BucketStore.ping_id(bucket["user_id"], ts[i])}
+            for f, values in columns.items():
+                p[f] = values[i] if i < len(values) else None
+            pings.append(p)
+        return pings
+
+    async def recent(self, user_id: str, n: int) -> List[dict]:
+        out = []
+        cursor = self.coll.find({"user_id": user_id}, {"user_id": 1, "date": 1, "timestamp": 1, "speed_kmh": 1})
+        async for bucket in cursor.sort("last_ts", -1):
+            out.extend(reversed(self._unpack(bucket, ("timestamp", "speed_kmh"))))
+            if len(out) >= n:
+                break
+        return out[:n]
+
+    async def distance_totals(self, day: str, user_id: Optional[str] = None) -> Dict[str, float]:
+        cursor = self.coll.aggregate([
+            {"$match": _scope(day, user_id)},
+            {"$group": {"_id": "$user_id", "total": {"$sum": {"$sum": "$distance_km"}}}}
+        ], allowDiskUse=True)
+        return {r["_id"]: float(r.get("total") or 0.0) async for r in cursor if r["_id"] is not None}
+
+    async def count(self, day: str, user_id: str) -> int:
+        cursor = self.coll.aggregate([
+            {"$match": _scope(day, user_id)},
+            {"$group": {"_id": None, "n": {"$sum": "$n"}}}
+        ])
+        rows = await cursor.to_list(length=1)
+        return int(rows[0]["n"]) if rows else 0
+
+    async def scan(self, day: Optional[str] = None, user_id: Optional[str] = None, user_ids: Optional[List[str]] = None,
+                   fields: Iterable[str] = PING_FIELDS, batch_size: int = 1000) -> AsyncIterator[dict]:
+        fields = tuple(dict.fromkeys(("timestamp", *fields)))
+        projection = {f: 1 for f in ("user_id", "date", *fields)}
+        # ~100 buckets per batch: a bucket holds up to an hour of pings
+        cursor = self.coll.find(_scope(day, user_id, user_ids), projection)
+        cursor = cursor.sort([("user_id", 1), ("date", 1), ("first_ts", 1)]).batch_size(max(1, batch_size // 10))
+        async for bucket in cursor:
+            for p in self._unpack(bucket, fields):
+                yield p
+
+    async def delete(self, day: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        return (await self.coll.delete_many(_scope(day, user_id))).deleted_count
+
+
+def make_store(layout: str):
+    if layout == "document":
+        return DocumentStore(db.gps_coll)
+    if layout == "bucket":
+        return BucketStore(db.gps_buckets_coll)
+    raise RuntimeError(f"Unknown GPS_STORAGE '{layout}' (use 'document' or 'bucket')")
+
+_store = None
+
+def get_store():
+    """The store for GPS_STORAGE (created on first use)."""
+    global _store
+    if _store is None:
+        _store = make_store(GPS_STORAGE)
+    return _store
+
+def set_store(store):
+    """Swap the active store (tests, benchmarks)."""
+    global _store
+    _store = store
+
+
+async def migrate(target: str, day: Optional[str] = None, user_id: Optional[str] = None, batch_size: int = 1000) -> dict:
+    """
+    Copy pings from the other layout into `target`, replacing whatever the
+    target already holds for the same scope. Switch GPS_STORAGE once done;
+    the source is left untouched.
+
+    Raises RuntimeError as soon as the target rejects a ping, so a partial
+    copy is never reported as done; fix the cause and rerun (the rerun
+    replaces the partial copy).
+    """
+    source = make_store("bucket" if target == "document" else "document")
+    dest = make_store(target)
+    removed = await dest.delete(day, user_id)
+
+    copied, chunk = 0, []
+
+    async def copy():
+        nonlocal copied
+        errors = await dest.insert(chunk)
+        copied += len(chunk) - len(errors)
+        if errors:
+            first = errors[min(errors)]
+            raise RuntimeError(
+                f"migrate to {dest.layout} aborted: {len(errors)} of {len(chunk)} pings rejected "
+                f"({copied} copied so far, first error: {first}); the {source.layout} layout is untouched"
+            )
+
+    async for p in source.scan(day=day, user_id=user_id, batch_size=batch_size):
+        p = {k: v for k, v in p.items() if k != "_id"}
+        chunk.append(p)
+        if len(chunk) >= batch_size:
+            await copy()
+            chunk = []
+    if chunk:
+        await copy()
+    return {"from": source.layout, "to": dest.layout, "replaced": removed, "copied_pings": copied}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GPS storage maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("migrate", help="copy pings from the other layout into --to")
+    m.add_argument("--to", required=True, choices=("document", "bucket"))
+    m.add_argument("--date", help="only this day (YYYY-MM-DD)")
+    m.add_argument("--user", help="only this user_id")
+    m.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    print(asyncio.run(migrate(args.to, day=args.date, user_id=args.user, batch_size=args.batch_size)))
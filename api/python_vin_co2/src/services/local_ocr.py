@@ -0,0 +1,38 @@
+# src/services/local_ocr.py
+"""
+Optional local OCR backends, tried before the remote Gemini call.
+Select one with LOCAL_OCR_BACKEND (unset = no local OCR). A backend is a
+blocking callable (image_bytes, mime_type) -> text.
+"""
+import io
+import os
+from typing import Callable, Dict, Optional
+
+OcrBackend = Callable[[bytes, str], str]
+
+# VIN alphabet (no I, O, Q) - keeps the local engine from guessing look-alikes
+_VIN_CHARS = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+
+
+def _tesseract(image_bytes: bytes, mime_type: str) -> str:
+    import pytesseract
+    from PIL import Image
+    img = Image.open(io.BytesIO(image_bytes))
+    return pytesseract.image_to_string(img, config=f"--psm 6 -c tessedit_char_whitelist={_VIN_CHARS}")
+
+
+_BACKENDS: Dict[str, OcrBackend] = {
+    "tesseract": _tesseract,
+}
+
+def register_backend(name: str, fn: OcrBackend):
+    """Make a custom local backend selectable through LOCAL_OCR_BACKEND."""
+    _BACKENDS[name] = fn
+
+def get_backend(name: Optional[str] = None) -> Optional[OcrBackend]:
+    name = (name if name is not None else os.getenv("LOCAL_OCR_BACKEND", "")).strip().lower()
+    if not name:
+        return None
+    if name not in _BACKENDS:
+        raise RuntimeError(f"Unknown LOCAL_OCR_BACKEND '{name}' (available: {', '.join(_BACKENDS)})")
+    return _BACKENDS[name]
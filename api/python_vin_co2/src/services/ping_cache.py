@@ -0,0 +1,86 @@
+# src/services/ping_cache.py
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Iterable, List, Optional
+
+# memory cap: max number of users tracked per worker (0 disables the cache)
+PING_CACHE_MAX_USERS = int(os.getenv("PING_CACHE_MAX_USERS", "50000"))
+
+
+class RecentSpeedCache:
+    """
+    Bounded LRU of per-user ring buffers holding the last `depth` ping speeds
+    (oldest first). Filled from Mongo on a miss and appended to after each
+    successful insert, so steady-state pings need no history read.
+
+    The cache is per worker process; a user whose pings hit different workers
+    only loses some smoothing context, never data.
+    """
+
+    def __init__(self, max_users: int = PING_CACHE_MAX_USERS, depth: int = 4):
+        self.max_users = max_users
+        self.depth = depth
+        self._entries: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0
+
+    def get(self, user_id: str) -> Optional[List[float]]:
+        """Cached speeds (oldest first) or None on a miss."""
+        with self._lock:
+            buf = self._entries.get(user_id)
+            if buf is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return list(buf)
+
+    def fill(self, user_id: str, speeds: Iterable[float]):
+        """Seed a user's buffer from stored history (oldest first)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = deque(speeds, maxlen=self.depth)
+            self._entries.move_to_end(user_id)
+            self._evict()
+
+    def push(self, user_id: str, speed: float):
+        """Record a newly stored ping. Users not yet tracked are left alone
+        (their next request fills the buffer from Mongo)."""
+        with self._lock:
+            buf = self._entries.get(user_id)
+            if buf is not None:
+                buf.append(speed)
+                self._entries.move_to_end(user_id)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self):
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "max_users": self.max_users,
+            "depth": self.depth,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,108 @@
+# src/services/reports.py
+"""
+CO2 reports over a date range, built from the per-user-day emissions
+records written by /calculate/daily and the daily batch job. The range
+query only reads the user_date_totals index (covered query), so a year
+of data is a few hundred index keys.
+"""
+import os
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from src.db import emissions_coll
+
+router = APIRouter(prefix="/reports", tags=["reports"])
+
+# longest range one report may cover
+REPORT_MAX_DAYS = int(os.getenv("REPORT_MAX_DAYS", "1100"))
+GRANULARITIES = ("day", "week", "month")
+
+
+def _parse(value: str, name: str) -> date:
+    try:
+        return date.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+
+def period_bounds(day: date, granularity: str):
+    """(first, last) day of the period containing `day`; weeks start on Monday."""
+    if granularity == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if granularity == "month":
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    return day, day
+
+async def daily_totals(user_id: str, start: date, end: date) -> Dict[str, dict]:
+    """{date: {total_kg_co2, distance_km}} for the user's emissions records in [start, end]."""
+    cursor = emissions_coll.find(
+        {"user_id": user_id, "date": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+        {"_id": 0, "date": 1, "total_kg_co2": 1, "distance_km": 1}
+    ).sort([("date", 1), ("created_at", 1)])
+    days = {}
+    async for d in cursor:
+        # records written before days were upserted may repeat a date: the newest one wins
+        days[d["date"]] = {
+            "total_kg_co2": float(d.get("total_kg_co2") or 0.0),
+            "distance_km": float(d.get("distance_km") or 0.0),
+        }
+    return days
+
+
+@router.get("/emissions")
+async def emissions_report(
+    user_id: str,
+    from_: str = Query(..., alias="from"),
+    to: Optional[str] = None,
+    granularity: str = "day",
+):
+    user_id = (user_id or "").strip()
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id required")
+    granularity = (granularity or "day").strip().lower()
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    start = _parse(from_, "from")
+    end = _parse(to, "to") if to else date.today()
+    if end < start:
+        raise HTTPException(status_code=400, detail="to must not be before from")
+    if (end - start).days + 1 > REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"range too long (max {REPORT_MAX_DAYS} days)")
+
+    days = await daily_totals(user_id, start, end)
+
+    periods: Dict[date, dict] = {}
+    for iso_day, totals in days.items():
+        first, last = period_bounds(date.fromisoformat(iso_day), granularity)
+        p = periods.setdefault(first, {
+            "period": first.isoformat() if granularity != "month" else first.strftime("%Y-%m"),
+            "start": max(first, start).isoformat(),
+            "end": min(last, end).isoformat(),
+            "total_kg_co2": 0.0,
+            "distance_km": 0.0,
+            "days": 0
+        })
+        p["total_kg_co2"] += totals["total_kg_co2"]
+        p["distance_km"] += totals["distance_km"]
+        p["days"] += 1
+
+    rows = [periods[k] for k in sorted(periods)]
+    for p in rows:
+        p["total_kg_co2"] = round(p["total_kg_co2"], 4)
+        p["distance_km"] = round(p["distance_km"], 4)
+
+    return {
+        "ok": True,
+        "user_id": user_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "total_kg_co2": round(sum(d["total_kg_co2"] for d in days.values()), 4),
+        "distance_km": round(sum(d["distance_km"] for d in days.values()), 4),
+        "days_with_data": len(days),
+        "periods": rows
+    }
@@ -0,0 +1,128 @@
+# src/services/rollups.py
+"""
+Per-day distance rollups maintained at ingest time.
+
+One daily_rollups document per (user_id, date, mode):
+    distance_km   - sum of the client-reported distance_km of the pings
+    pings         - number of pings
+
+Lat/lon distance is not rolled up: it depends on the order of the day's
+pings, which ingest does not see (pings arrive late, out of order and on
+different workers), so days without client distances are summed from the
+raw logs.
+
+/calculate/daily reads distance_km from these few documents instead of
+scanning the day's gps_logs, as long as `pings` matches the stored pings.
+Rebuild them from the raw logs with:
+    python -m src.services.rollups [--date YYYY-MM-DD] [--user USER_ID]
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Iterable, Optional
+
+from pymongo import UpdateOne
+
+from src.db import rollups_coll
+from src.services.gps_store import get_store
+
+
+def _inc_op(user_id: str, day: str, mode: str, distance_km: float, pings: int = 1) -> UpdateOne:
+    return UpdateOne(
+        {"user_id": user_id, "date": day, "mode": mode},
+        {
+            "$inc": {"distance_km": distance_km, "pings": pings},
+            "$set": {"updated_at": datetime.utcnow()}
+        },
+        upsert=True
+    )
+
+async def record_pings(docs: Iterable[dict]):
+    """
+    Fold stored gps docs into the rollups. A failure is logged, not raised: the ping itself is already stored and the
+    rollups can be rebuilt with the backfill command.
+    """
+    ops = [
+        _inc_op(doc["user_id"], doc["date"], doc.get("inferred_mode") or "UNKNOWN",
+                float(doc["distance_km"]) if doc.get("distance_km") is not None else 0.0)
+        for doc in docs
+    ]
+    if not ops:
+        return
+    try:
+        await rollups_coll.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print("Warning: failed to update daily rollups:", repr(e))
+
+async def read_daily_distance(user_id: str, day: str) -> Optional[dict]:
+    """Totals for one user-day from the rollups, or None when no rollup exists."""
+    docs = await rollups_coll.find(
+        {"user_id": user_id, "date": day},
+        {"_id": 0, "mode": 1, "distance_km": 1, "pings": 1}
+    ).to_list(length=None)
+    if not docs:
+        return None
+    return {
+        "distance_km": sum(float(d.get("distance_km") or 0.0) for d in docs),
+        "pings": sum(int(d.get("pings") or 0) for d in docs),
+    }
+
+async def backfill(day: Optional[str] = None, user_id: Optional[str] = None, batch_size: int = 1000) -> dict:
+    """
+    Rebuild rollups from the stored pings (optionally for one date and/or user).
+    Streams the pings in (user_id, date) order, so memory stays proportional
+    to one user-day of totals. Pings ingested for the same scope
+    while this runs may be missed - backfill past days, or run it off-peak.
+    """
+    query = {}
+    if day:
+        query["date"] = day
+    if user_id:
+        query["user_id"] = user_id
+
+    await rollups_coll.delete_many(query)
+
+    totals = {}      # (mode) -> [distance_km, pings] for the current user-day
+    key = None       # (user_id, date) being accumulated
+    ops, written, scanned = [], 0, 0
+
+    async def flush_ops():
+        nonlocal ops, written
+        if ops:
+            await rollups_coll.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+
+    def close_user_day():
+        for mode, (dist, n) in totals.items():
+            ops.append(_inc_op(key[0], key[1], mode, dist, n))
+        totals.clear()
+
+    fields = ("distance_km", "inferred_mode")
+    async for d in get_store().scan(day=day, user_id=user_id, fields=fields, batch_size=batch_size):
+        scanned += 1
+        doc_key = (d.get("user_id"), d.get("date"))
+        if doc_key != key:
+            if key is not None:
+                close_user_day()
+            key = doc_key
+
+        t = totals.setdefault(d.get("inferred_mode") or "UNKNOWN", [0.0, 0])
+        t[0] += float(d["distance_km"]) if d.get("distance_km") is not None else 0.0
+        t[1] += 1
+
+        if len(ops) >= batch_size:
+            await flush_ops()
+
+    if key is not None:
+        close_user_day()
+    await flush_ops()
+    return {"scanned_pings": scanned, "rollups_written": written}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild daily_rollups from gps_logs")
+    parser.add_argument("--date", help="only this day (YYYY-MM-DD)")
+    parser.add_argument("--user", help="only this user_id")
+    args = parser.parse_args()
+    print(asyncio.run(backfill(day=args.date, user_id=args.user)))
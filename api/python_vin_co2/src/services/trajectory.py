@@ -0,0 +1,130 @@
+# src/services/trajectory.py
+"""
+Vectorized (NumPy) versions of the per-point GPS helpers in services/gps.py,
+working on one user-day as columnar arrays:
+
+    segment distances -> speeds (derived from time deltas where missing)
+    -> centered rolling-mean smoothing -> mode per point -> km per mode
+
+Missing values are NaN. Results match the scalar helpers (haversine_km,
+smooth_speeds, infer_mode_from_speed); benchmarks/trajectory.py checks that.
+"""
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+# same thresholds as gps.infer_mode_from_speed: speed <= bound -> mode
+MODE_BOUNDS = np.array([7.0, 25.0, 100.0])
+MODES = np.array(["WALK", "BIKE", "CAR", "OTHER"])
+
+
+class DayTrajectory(NamedTuple):
+    segment_km: np.ndarray     # km covered by each point since the previous one
+    speed_kmh: np.ndarray      # reported speed, or derived from distance/time when missing
+    smoothed_kmh: np.ndarray   # centered rolling mean of speed_kmh
+    modes: np.ndarray          # inferred mode per point
+    by_mode: Dict[str, float]  # km per mode
+    total_km: float
+
+
+def _floats(values: Iterable) -> np.ndarray:
+    """Float array with None -> NaN."""
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+def columns_from_docs(docs: Iterable[dict]) -> Dict[str, np.ndarray]:
+    """gps_logs docs (already sorted by timestamp) -> lat/lon/speed/distance/timestamp columns."""
+    docs = list(docs)
+    ts = [d.get("timestamp") for d in docs]
+    return {
+        "lat": _floats(d.get("lat") for d in docs),
+        "lon": _floats(d.get("lon") for d in docs),
+        "speed_kmh": _floats(d.get("speed_kmh") for d in docs),
+        "distance_km": _floats(d.get("distance_km") for d in docs),
+        "timestamp": _floats(t.timestamp() if hasattr(t, "timestamp") else None for t in ts),
+    }
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def hop_km(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Haversine km from each point to the previous one; 0 for the first point or when either lacks coordinates."""
+    hops = np.zeros(len(lat))
+    if len(lat) > 1:
+        d = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        hops[1:] = np.nan_to_num(d, nan=0.0)
+    return hops
+
+def segment_km(lat: np.ndarray, lon: np.ndarray, distance_km: Optional[np.ndarray] = None) -> np.ndarray:
+    """Client-reported distance_km where present, lat/lon hop distance otherwise."""
+    hops = hop_km(lat, lon)
+    if distance_km is None:
+        return hops
+    return np.where(np.isnan(distance_km), hops, distance_km)
+
+def derive_speeds(speed_kmh: np.ndarray, seg_km: np.ndarray, timestamp_s: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Missing speeds become segment km / elapsed hours since the previous point
+    (0 when that can't be computed); without timestamps they are just 0.
+    """
+    speeds = np.array(speed_kmh, dtype=float)
+    missing = np.isnan(speeds)
+    if timestamp_s is not None and len(speeds) > 1 and missing[1:].any():
+        dt_h = np.full(len(speeds), np.nan)
+        dt_h[1:] = np.diff(timestamp_s) / 3600.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            derived = np.where(dt_h > 0, seg_km / dt_h, np.nan)
+        speeds[missing] = derived[missing]
+    return np.nan_to_num(speeds, nan=0.0, posinf=0.0, neginf=0.0)
+
+def smooth(speeds: np.ndarray, window: int = 3) -> np.ndarray:
+    """Centered rolling mean, truncated at the edges (same as gps.smooth_speeds), O(n) via cumulative sums."""
+    speeds = np.asarray(speeds, dtype=float)
+    n = len(speeds)
+    if window <= 1 or n < 2:
+        return speeds.copy()
+    half = window // 2
+    csum = np.concatenate(([0.0], np.cumsum(speeds)))
+    idx = np.arange(n)
+    start = np.maximum(idx - half, 0)
+    end = np.minimum(idx + half + 1, n)
+    return (csum[end] - csum[start]) / (end - start)
+
+def mode_codes(speeds: np.ndarray) -> np.ndarray:
+    """Index into MODES for each speed."""
+    return np.searchsorted(MODE_BOUNDS, speeds, side="left")
+
+def infer_modes(speeds: np.ndarray) -> np.ndarray:
+    return MODES[mode_codes(speeds)]
+
+def analyze_day(lat, lon, speed_kmh=None, timestamp_s=None, distance_km=None,
+                window: int = 3, derive_missing_speeds: bool = True) -> DayTrajectory:
+    """
+    One pass over a user-day (points sorted by time). With
+    derive_missing_speeds=False missing speeds count as 0, like the
+    original /gps/daily-modes.
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    n = len(lat)
+    speed_kmh = np.full(n, np.nan) if speed_kmh is None else np.asarray(speed_kmh, dtype=float)
+    distance_km = None if distance_km is None else np.asarray(distance_km, dtype=float)
+
+    seg = segment_km(lat, lon, distance_km)
+    speeds = derive_speeds(speed_kmh, seg, timestamp_s if derive_missing_speeds else None)
+    smoothed = smooth(speeds, window)
+    codes = mode_codes(smoothed)
+    km_per_code = np.bincount(codes, weights=seg, minlength=len(MODES))
+    present = np.bincount(codes, minlength=len(MODES)) > 0
+    by_mode = {str(MODES[i]): float(km_per_code[i]) for i in range(len(MODES)) if present[i]}
+    return DayTrajectory(
+        segment_km=seg,
+        speed_kmh=speeds,
+        smoothed_kmh=smoothed,
+        modes=MODES[codes],
+        by_mode=by_mode,
+        total_km=float(seg.sum()),
+    )
@@ -0,0 +1,167 @@
+# src/services/vehicles.py
+import csv
+import io
+import os
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+from src.db import vehicles_coll
+from src.services.vin_lookup import decode_vins_vpic
+from src.utils.validators import VIN_REGEX, normalize_fuel
+
+if TYPE_CHECKING:   # numpy/pandas are imported on the first bulk onboarding
+    import pandas as pd
+
+router = APIRouter(prefix="/vehicles", tags=["vehicles"])
+
+# upper bound on rows accepted by one /vehicles/bulk call
+VEHICLES_BULK_MAX = int(os.getenv("VEHICLES_BULK_MAX", "5000"))
+
+# (keyword in BodyClass/VehicleType, category) - first match wins, otherwise CAR
+_CATEGORY_RULES = [
+    ("TRUCK", "TRUCK_HEAVY"),
+    ("BUS", "BUS"),
+    ("MOTORCYCLE", "MOTORCYCLE"),
+]
+_DEFAULT_CATEGORY = "CAR"
+
+
+def categorize_vehicle(body: Optional[str], vehicle_type: Optional[str]) -> str:
+    """Category heuristic for one decoded vehicle."""
+    body, vehicle_type = str(body or "").upper(), str(vehicle_type or "").upper()
+    for keyword, category in _CATEGORY_RULES:
+        if keyword in body or keyword in vehicle_type:
+            return category
+    return _DEFAULT_CATEGORY
+
+def categorize_vehicles(body: "pd.Series", vehicle_type: "pd.Series") -> "pd.Series":
+    """Vectorized categorize_vehicle over whole columns."""
+    import numpy as np
+    import pandas as pd
+    # '|' can't occur in a keyword, so matching the joined text == matching either field
+    text = (body.fillna("").astype(str) + "|" + vehicle_type.fillna("").astype(str)).str.upper()
+    conditions = [text.str.contains(keyword, regex=False) for keyword, _ in _CATEGORY_RULES]
+    choices = [category for _, category in _CATEGORY_RULES]
+    return pd.Series(np.select(conditions, choices, default=_DEFAULT_CATEGORY), index=text.index)
+
+def _fuel_of(decoded: dict) -> Optional[str]:
+    return decoded.get("FuelTypePrimary") or decoded.get("FuelType") or decoded.get("FuelTypePrimary1") or None
+
+
+class VehicleVin(BaseModel):
+    user_id: str
+    vin: str
+
+
+async def onboard_vehicles(pairs: List[Tuple[str, str]]) -> dict:
+    """
+    Decode and store one vehicle per (user_id, vin) pair. vehicles are keyed
+    by user_id, so when a user appears more than once the last row wins.
+    """
+    results: List[dict] = [None] * len(pairs)
+    latest: Dict[str, int] = {}
+    for i, (user_id, vin) in enumerate(pairs):
+        user_id, vin = (user_id or "").strip(), (vin or "").strip().upper()
+        if not user_id:
+            results[i] = {"index": i, "ok": False, "user_id": user_id, "vin": vin, "error": "missing user_id"}
+        elif not VIN_REGEX.fullmatch(vin):
+            results[i] = {"index": i, "ok": False, "user_id": user_id, "vin": vin, "error": "invalid VIN"}
+        else:
+            if user_id in latest:
+                j = latest[user_id]
+                results[j] = {"index": j, "ok": False, "user_id": user_id, "vin": pairs[j][1].strip().upper(),
+                              "error": "superseded by a later row for the same user_id"}
+            latest[user_id] = i
+            results[i] = {"index": i, "user_id": user_id, "vin": vin}
+
+    rows = [results[i] for i in sorted(latest.values())]
+    decoded = await decode_vins_vpic([r["vin"] for r in rows]) if rows else {}
+
+    ok_rows = []
+    for r in rows:
+        d = decoded.get(r["vin"])
+        if d:
+            ok_rows.append(r)
+        else:
+            r.update(ok=False, error="VIN could not be decoded")
+
+    ops = []
+    if ok_rows:
+        import pandas as pd
+        frame = pd.DataFrame({
+            "body": [decoded[r["vin"]].get("BodyClass") for r in ok_rows],
+            "vehicle_type": [decoded[r["vin"]].get("VehicleType") for r in ok_rows],
+        })
+        categories = categorize_vehicles(frame["body"], frame["vehicle_type"]).tolist()
+        now = datetime.utcnow()
+        for r, cat in zip(ok_rows, categories):
+            d = decoded[r["vin"]]
+            fuel_norm = normalize_fuel(_fuel_of(d))
+            r.update(ok=True, vehicle_category=cat, fuel_type=fuel_norm)
+            ops.append(UpdateOne({"user_id": r["user_id"]}, {"$set": {
+                "user_id": r["user_id"],
+                "vin": r["vin"],
+                "decoded": d,
+                "vehicle_category": cat,
+                "fuel_type": fuel_norm,
+                "stored_at": now
+            }}, upsert=True))
+
+    if ops:
+        try:
+            await vehicles_coll.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                r = ok_rows[err["index"]]
+                r.update(ok=False, error=err.get("errmsg", "write failed"))
+                r.pop("vehicle_category", None)
+                r.pop("fuel_type", None)
+        except ServerSelectionTimeoutError as e:
+            print("DB timeout while storing vehicles:", repr(e))
+            raise HTTPException(status_code=503, detail="Database unavailable (timeout)")
+        except Exception as e:
+            print("DB bulk vehicle write failed:", repr(e))
+            raise HTTPException(status_code=503, detail="Database unavailable")
+
+    stored = sum(1 for r in results if r.get("ok"))
+    return {
+        "ok": stored == len(results),
+        "received": len(results),
+        "stored": stored,
+        "failed": len(results) - stored,
+        "results": results
+    }
+
+def _check_size(n: int):
+    if n == 0:
+        raise HTTPException(status_code=400, detail="No vehicles provided")
+    if n > VEHICLES_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many vehicles in one request (max {VEHICLES_BULK_MAX})")
+
+
+@router.post("/bulk")
+async def vehicles_bulk(vehicles: List[VehicleVin]):
+    _check_size(len(vehicles))
+    return await onboard_vehicles([(v.user_id, v.vin) for v in vehicles])
+
+@router.post("/bulk/csv")
+async def vehicles_bulk_csv(file: UploadFile = File(...)):
+    """CSV with a header row containing user_id and vin columns (any order, case-insensitive)."""
+    raw = await file.read()
+    try:
+        reader = csv.DictReader(io.StringIO(raw.decode("utf-8-sig")))
+        columns = {(name or "").strip().lower(): name for name in (reader.fieldnames or [])}
+        if "user_id" not in columns or "vin" not in columns:
+            raise HTTPException(status_code=400, detail="CSV must have user_id and vin columns")
+        pairs = [(row.get(columns["user_id"]), row.get(columns["vin"])) for row in reader]
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
+    except csv.Error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV: {e}")
+    _check_size(len(pairs))
+    return await onboard_vehicles(pairs)
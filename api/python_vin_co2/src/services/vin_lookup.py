@@ -1,14 +1,239 @@
 # src/services/vin_lookup.py
-import httpx
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-VPIC_BASE = "https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVinValues/"
+from pymongo import UpdateOne
+
+from src.db import vin_cache_coll
+
+if TYPE_CHECKING:   # httpx is imported with the first client
+    import httpx
+
+# VPIC_BASE can point at a local fake vPIC server in tests
+VPIC_BASE = os.getenv("VPIC_BASE", "https://vpic.nhtsa.dot.gov/api/vehicles/DecodeVinValues/")
+VPIC_TIMEOUT_S = float(os.getenv("VPIC_TIMEOUT_S", "20"))
+VPIC_BATCH_URL = os.getenv("VPIC_BATCH_URL", VPIC_BASE.rstrip("/").rsplit("/", 1)[0] + "/DecodeVINValuesBatch/")
+VPIC_BATCH_SIZE = 50   # vPIC accepts at most 50 VINs per batch call
+VPIC_BATCH_CONCURRENCY = int(os.getenv("VPIC_BATCH_CONCURRENCY", "4"))
+VIN_CACHE_SIZE = int(os.getenv("VIN_CACHE_SIZE", "10000"))   # in-process LRU entries
+
+# one pooled keep-alive client for every vPIC call (created on first use)
+_client: Optional["httpx.AsyncClient"] = None
+
+def get_client() -> "httpx.AsyncClient":
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+        _client = httpx.AsyncClient(
+            timeout=VPIC_TIMEOUT_S,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def pattern_key(vin: str) -> str:
+    """
+    vPIC decodes by VIN pattern: WMI + VDS (positions 1-8) plus model year and
+    plant (positions 10-11). The check digit and serial number don't change
+    the decoded vehicle, so VINs sharing this key share their decode.
+    """
+    return vin[:8] + vin[9:11]
+
+
+class _Lru:
+    def __init__(self, size: int):
+        self.size = size
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+_lru = _Lru(VIN_CACHE_SIZE)
+_stats = {"lru_hits": 0, "mongo_hits": 0, "pattern_hits": 0, "vpic_calls": 0}
+
+def cache_stats() -> dict:
+    return {**_stats, "lru_size": len(_lru._data), "lru_max": _lru.size}
+
+def _from_pattern(decoded: dict, vin: str) -> dict:
+    """Reuse another VIN's decode for this VIN (same pattern key)."""
+    out = dict(decoded)
+    out["VIN"] = vin
+    return out
+
+def _lru_lookup(vin: str) -> Optional[dict]:
+    hit = _lru.get(vin)
+    if hit is not None:
+        _stats["lru_hits"] += 1
+        return dict(hit)   # callers may annotate the result; keep the cached copy clean
+    hit = _lru.get(pattern_key(vin))
+    if hit is not None:
+        _stats["pattern_hits"] += 1
+        return _from_pattern(hit, vin)
+    return None
+
+async def _cache_get_many(vins: List[str]) -> Dict[str, dict]:
+    """Cached decodes for as many of vins as possible: LRU first, then one vin_cache query."""
+    found: Dict[str, dict] = {}
+    missing = []
+    for vin in vins:
+        hit = _lru_lookup(vin)
+        if hit is not None:
+            found[vin] = hit
+        else:
+            missing.append(vin)
+    if not missing:
+        return found
+
+    ids = set(missing) | {pattern_key(v) for v in missing}
+    try:
+        docs = await vin_cache_coll.find({"_id": {"$in": list(ids)}}).to_list(length=None)
+    except Exception as e:
+        print("Warning: vin_cache read failed:", repr(e))
+        return found
+    by_id = {d["_id"]: d.get("decoded") for d in docs}
+    for vin in missing:
+        key = pattern_key(vin)
+        if by_id.get(vin):
+            _stats["mongo_hits"] += 1
+            _lru.put(vin, by_id[vin])
+            found[vin] = dict(by_id[vin])   # as in _lru_lookup: the LRU keeps its own copy
+        elif by_id.get(key):
+            _stats["pattern_hits"] += 1
+            _lru.put(key, by_id[key])
+            found[vin] = _from_pattern(by_id[key], vin)
+    return found
+
+def _cache_entries(vin: str, decoded: dict) -> List[Tuple[str, dict]]:
+    entries = [(vin, decoded)]
+    # only share clean decodes (ErrorCode "0"); errors are often VIN-specific (check digit)
+    if str(decoded.get("ErrorCode", "")).strip() == "0":
+        entries.append((pattern_key(vin), decoded))
+    return entries
+
+async def cache_put_many(decodes: Dict[str, dict]):
+    """Store fresh decodes under their VIN and, for clean decodes, under the pattern key."""
+    ops = []
+    now = datetime.utcnow()
+    for vin, decoded in decodes.items():
+        for key, value in _cache_entries(vin, decoded):
+            _lru.put(key, dict(value))   # the caller gets `decoded` back and may annotate it
+            ops.append(UpdateOne({"_id": key}, {"$set": {"decoded": value, "cached_at": now}}, upsert=True))
+    if not ops:
+        return
+    try:
+        await vin_cache_coll.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print("Warning: vin_cache write failed:", repr(e))
+
+async def cache_put(vin: str, decoded: dict):
+    await cache_put_many({vin: decoded})
 
 async def decode_vin_vpic(vin: str):
+    vin = vin.upper()
+    cached = (await _cache_get_many([vin])).get(vin)
+    if cached is not None:
+        return cached
+
     url = f"{VPIC_BASE}{vin}?format=json"
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        r = await client.get(url)
-        if r.status_code != 200:
-            return None
-        data = r.json()
-        results = data.get("Results") or []
-        return results[0] if results else None
+    _stats["vpic_calls"] += 1
+    r = await get_client().get(url)
+    if r.status_code != 200:
+        return None
+    data = r.json()
+    results = data.get("Results") or []
+    decoded = results[0] if results else None
+    if decoded:
+        await cache_put(vin, decoded)
+    return decoded
+
+
+async def _decode_batch_vpic(vins: List[str]) -> Dict[str, dict]:
+    """One DecodeVINValuesBatch call (at most VPIC_BATCH_SIZE VINs)."""
+    _stats["vpic_calls"] += 1
+    r = await get_client().post(VPIC_BATCH_URL, data={"format": "json", "data": ";".join(vins)})
+    if r.status_code != 200:
+        print(f"Warning: vPIC batch decode failed with HTTP {r.status_code}")
+        return {}
+    out = {}
+    for row in r.json().get("Results") or []:
+        vin = str(row.get("VIN") or "").upper()
+        if vin:
+            out[vin] = row
+    return out
+
+async def decode_vins_vpic(vins: List[str], concurrency: int = VPIC_BATCH_CONCURRENCY) -> Dict[str, Optional[dict]]:
+    """
+    Decode many VINs: cached ones are served from the LRU / vin_cache, the rest
+    go to vPIC in batches of VPIC_BATCH_SIZE with at most `concurrency` calls in
+    flight. Returns {VIN: decoded or None}.
+    """
+    unique = list(dict.fromkeys(v.upper() for v in vins))
+    found = await _cache_get_many(unique)
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(chunk):
+        import httpx
+        async with sem:
+            try:
+                return await _decode_batch_vpic(chunk)
+            except httpx.HTTPError as e:
+                print("Warning: vPIC batch decode failed:", repr(e))
+                return {}
+
+    async def fetch(todo):
+        chunks = [todo[i:i + VPIC_BATCH_SIZE] for i in range(0, len(todo), VPIC_BATCH_SIZE)]
+        fresh: Dict[str, dict] = {}
+        for part in await asyncio.gather(*(run(c) for c in chunks)):
+            fresh.update(part)
+        await cache_put_many(fresh)
+        found.update(fresh)
+
+    # first pass: one VIN per pattern key; a clean decode covers the rest of its pattern
+    todo, seen_keys = [], set()
+    for vin in unique:
+        key = pattern_key(vin)
+        if vin not in found and key not in seen_keys:
+            seen_keys.add(key)
+            todo.append(vin)
+    await fetch(todo)
+    tried = set(todo)
+
+    # second pass: VINs whose pattern didn't decode cleanly still get their own call
+    leftover = []
+    for vin in unique:
+        if vin in found:
+            continue
+        hit = _lru.get(pattern_key(vin))
+        if hit is not None:
+            _stats["pattern_hits"] += 1
+            found[vin] = _from_pattern(hit, vin)
+        elif vin not in tried:
+            leftover.append(vin)
+    if leftover:
+        await fetch(leftover)
+    return {vin: found.get(vin) for vin in unique}
@@ -0,0 +1,328 @@
+# src/services/write_behind.py
+"""
+Opt-in write-behind persistence for GPS pings (GPS_WRITE_BEHIND=1).
+
+/gps/update and /gps/update/batch validate, mode-infer and enqueue pings, then
+answer without waiting for Mongo. One background task per worker drains the
+bounded queue through get_store().insert, flushing when GPS_WB_FLUSH_SIZE
+pings are waiting or GPS_WB_FLUSH_INTERVAL_S has passed since the first one.
+
+At-least-once: a flush that fails (timeout, Mongo down...) is appended to a
+local JSONL spool file and fsynced; the spool is replayed on startup and every
+GPS_WB_RETRY_S while it is non-empty. Every ping gets its _id before it is
+queued, so a replayed ping that did reach Mongo is rejected as a duplicate key
+and skipped (the bucket layout has no unique per-ping key and may store it
+twice). Rollups are updated after each successful flush; a ping whose insert
+succeeded but was reported as failed is skipped as a duplicate on replay, so
+its rollup is missing until the rollups backfill runs. On shutdown the queue
+is drained for up to GPS_WB_DRAIN_TIMEOUT_S; whatever is left goes to the
+spool.
+
+Workers share the spool file: appends hold an flock on <spool>.lock and only
+one worker at a time replays (flock on <spool>.replay.lock), so a spooled
+ping is replayed once. Spool file I/O runs on a thread, off the event loop.
+
+A full queue raises WriteBehindFullError (callers answer 429). Pings waiting
+in the queue are not visible to reads (daily modes, /calculate/daily) until
+flushed.
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo.errors import WriteError
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): run a single worker with write-behind
+    fcntl = None
+
+from src.services import rollups
+from src.services.gps_store import get_store
+
+GPS_WRITE_BEHIND = os.getenv("GPS_WRITE_BEHIND", "0") == "1"
+GPS_WB_QUEUE_MAX = int(os.getenv("GPS_WB_QUEUE_MAX", "50000"))          # pings waiting per worker
+GPS_WB_FLUSH_SIZE = int(os.getenv("GPS_WB_FLUSH_SIZE", "500"))          # pings per insert
+GPS_WB_FLUSH_INTERVAL_S = float(os.getenv("GPS_WB_FLUSH_INTERVAL_S", "0.5"))
+GPS_WB_RETRY_S = float(os.getenv("GPS_WB_RETRY_S", "5"))                # spool replay interval
+GPS_WB_DRAIN_TIMEOUT_S = float(os.getenv("GPS_WB_DRAIN_TIMEOUT_S", "10"))
+GPS_WB_SPOOL_PATH = os.getenv("GPS_WB_SPOOL_PATH", "gps_spool.jsonl")
+
+# a gps doc ready to insert (inferred_mode set, no _id yet)
+Item = dict
+
+
+class WriteBehindFullError(RuntimeError):
+    """Raised when the write-behind queue has no room for the pings (callers should answer 429)."""
+
+
+def _encode(value):
+    # keeps the ping's own timezone offset (bson.json_util would turn it into naive UTC)
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"cannot spool {type(value).__name__}")
+
+def _decode(obj: dict):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+    return obj
+
+def _is_duplicate(errmsg: str) -> bool:
+    return "E11000" in errmsg or "duplicate key" in errmsg
+
+def _open_lock(path: str, wait: bool = True):
+    """Open and flock `path`; None when wait=False and another process holds it. close() releases."""
+    f = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
+
+def _append_synced(path: str, lines: str):
+    lock = _open_lock(path + ".lock")
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        lock.close()
+
+
+class WriteBehindQueue:
+    def __init__(self, max_size: int = GPS_WB_QUEUE_MAX, flush_size: int = GPS_WB_FLUSH_SIZE,
+                 flush_interval_s: float = GPS_WB_FLUSH_INTERVAL_S, spool_path: str = GPS_WB_SPOOL_PATH,
+                 retry_s: float = GPS_WB_RETRY_S):
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval_s = flush_interval_s
+        self.spool_path = spool_path
+        self.retry_s = retry_s
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._in_flight: List[Item] = []
+        self._next_replay = 0.0
+        self.counters = {"enqueued": 0, "flushed": 0, "flushes": 0, "failed_flushes": 0, "spooled": 0,
+                         "replayed": 0, "duplicates": 0, "rejected": 0, "full": 0}
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._stopping
+
+    def start(self):
+        """Start the flush task on the running loop (replays any spool first)."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, items: List[Item]):
+        """Queue pings (all or none); each doc gets its store _id here."""
+        if not self.running:
+            raise RuntimeError("write-behind queue is not running")
+        if self._queue.qsize() + len(items) > self.max_size:
+            self.counters["full"] += 1
+            raise WriteBehindFullError(f"write-behind queue full ({self.max_size} pings)")
+        store = get_store()
+        for doc in items:
+            store.assign_id(doc)
+            self._queue.put_nowait(doc)
+        self.counters["enqueued"] += len(items)
+
+    async def stop(self, timeout: float = GPS_WB_DRAIN_TIMEOUT_S):
+        """Stop taking pings and flush what is queued; spool the rest after `timeout`."""
+        if self._task is None:
+            return
+        self._stopping = True
+        if not self._queue.full():
+            self._queue.put_nowait(None)   # wakes the task if it is waiting for pings
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            left = self._in_flight + self._take_all()
+            if left:
+                print(f"Warning: write-behind drain timed out, spooling {len(left)} pings")
+                await self._spool(left)
+        except Exception as e:
+            print("Warning: write-behind task failed:", repr(e))
+        self._task = None
+
+    def _take_all(self) -> List[Item]:
+        items = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                items.append(item)
+        return items
+
+    async def _next_batch(self) -> List[Item]:
+        """Wait for the first ping, then collect up to flush_size or until flush_interval_s passes."""
+        try:
+            first = await asyncio.wait_for(self._queue.get(), self.retry_s)
+        except asyncio.TimeoutError:
+            return []
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.flush_size:
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        await self._safe_replay()
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if time.monotonic() >= self._next_replay and not self._stopping:
+                await self._safe_replay()
+
+    async def _safe_replay(self):
+        try:
+            await self._replay()
+        except Exception as e:
+            # a broken spool must not stop the flushing; it is retried every GPS_WB_RETRY_S
+            self.last_error = repr(e)
+            print("Warning: write-behind spool replay failed:", repr(e))
+
+    async def _flush(self, items: List[Item]) -> bool:
+        """Insert one batch; spool it if the store is unreachable. True when Mongo took it."""
+        self._in_flight = items   # left set if the task is cancelled mid-insert, so stop() spools it
+        try:
+            errors = await get_store().insert(items)
+        except WriteError as e:
+            # single-ping inserts raise instead of returning the error; a rejected
+            # ping (duplicate, validation...) must not be spooled and replayed forever
+            errors = {0: str(e)}
+        except Exception as e:
+            self._in_flight = []
+            self.counters["failed_flushes"] += 1
+            self.last_error = repr(e)
+            print(f"Warning: write-behind flush of {len(items)} pings failed, spooling:", repr(e))
+            await self._spool(items)
+            return False
+        self._in_flight = []
+
+        stored = []
+        for i, doc in enumerate(items):
+            err = errors.get(i)
+            if err is None:
+                stored.append(doc)
+            elif _is_duplicate(err):
+                self.counters["duplicates"] += 1   # already stored by an earlier attempt
+            else:
+                self.counters["rejected"] += 1
+                print("Warning: write-behind ping rejected:", err)
+        self.counters["flushes"] += 1
+        self.counters["flushed"] += len(stored)
+        await rollups.record_pings(stored)
+        return True
+
+    async def _spool(self, items: List[Item]):
+        lines = "".join(json.dumps({"doc": doc}, default=_encode) + "\n" for doc in items)
+        await asyncio.to_thread(_append_synced, self.spool_path, lines)
+        self.counters["spooled"] += len(items)
+        self._next_replay = time.monotonic() + self.retry_s
+
+    def _claim_spool(self, replaying: str) -> bool:
+        """Rename the spool to `replaying` (unless a crashed replay left one). False when there is nothing to do."""
+        if os.path.exists(replaying):
+            return True
+        lock = _open_lock(self.spool_path + ".lock")   # no append lands between the size check and the rename
+        try:
+            if not os.path.exists(self.spool_path) or os.path.getsize(self.spool_path) == 0:
+                return False
+            os.replace(self.spool_path, replaying)
+            return True
+        finally:
+            lock.close()
+
+    def _read_items(self, f) -> List[Item]:
+        items = []
+        for line in f:
+            if line.strip():
+                rec = json.loads(line, object_hook=_decode)
+                items.append(rec["doc"])
+            if len(items) >= self.flush_size:
+                break
+        return items
+
+    async def _replay(self):
+        """
+        Re-insert spooled pings. The spool is renamed first so failures during
+        the replay append to a fresh file; a leftover .replay file (crash
+        mid-replay) is finished before the spool. Skipped while another
+        worker holds the replay lock.
+        """
+        self._next_replay = time.monotonic() + self.retry_s
+        lock = await asyncio.to_thread(_open_lock, self.spool_path + ".replay.lock", False)
+        if lock is None:
+            return
+        try:
+            replaying = self.spool_path + ".replay"
+            if not await asyncio.to_thread(self._claim_spool, replaying):
+                return
+            f = await asyncio.to_thread(open, replaying, "r", encoding="utf-8")
+            try:
+                while True:
+                    items = await asyncio.to_thread(self._read_items, f)
+                    if not items:
+                        break
+                    if not await self._flush(items):
+                        # Mongo is still away: the batch was re-spooled, keep the unread rest too
+                        rest = await asyncio.to_thread(lambda: "".join(line for line in f if line.strip()))
+                        if rest:
+                            await asyncio.to_thread(_append_synced, self.spool_path, rest)
+                        break
+                    self.counters["replayed"] += len(items)
+            finally:
+                f.close()
+            await asyncio.to_thread(os.remove, replaying)
+        finally:
+            lock.close()
+
+    def stats(self) -> dict:
+        spool_bytes = sum(os.path.getsize(p) for p in (self.spool_path, self.spool_path + ".replay") if os.path.exists(p))
+        return {
+            "enabled": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_size,
+            "flush_size": self.flush_size,
+            "flush_interval_s": self.flush_interval_s,
+            "spool_bytes": spool_bytes,
+            "last_error": self.last_error,
+            **self.counters,
+        }
+
+
+queue = WriteBehindQueue()
@@ -1,11 +1,30 @@
 # src/utils/excel_loader.py
 from pathlib import Path
-import pandas as pd
+import hashlib
+import logging
 import os
+import pickle
+import time
+
+logger = logging.getLogger("uvicorn.error")
 
 DATA_DIR = Path(os.getenv("DATA_DIR", "transport_co2_data"))
 
+# on-disk snapshot of the normalized tables (see load_all_tables)
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", str(DATA_DIR / ".snapshot")))
+SNAPSHOT_ENABLED = os.getenv("TABLE_SNAPSHOT", "1") != "0"
+SNAPSHOT_FORMAT = 1  # bump when the normalized column layout changes
+
+SOURCE_FILES = (
+    "Electricity_co2_countrywise.xlsx",
+    "fuel_emission_factors_worldwide.xlsx",
+    "Fuelconsumption_countrywise_vehiclewise.xlsx",
+)
+
 def _read_xlsx(name: str):
+    # pandas is imported here rather than at module load: it is the slowest
+    # import in the service and only needed when the spreadsheets are parsed
+    import pandas as pd
     path = DATA_DIR / name
     if not path.exists():
         raise FileNotFoundError(f"{path} not found. Place your Excel file there.")
@@ -19,6 +38,7 @@ def load_grid_factors():
     Returns DataFrame with columns:
       ['country_code', 'subregion', 'grid_co2_kg_per_kwh']
     """
+    import pandas as pd
     df = _read_xlsx("Electricity_co2_countrywise.xlsx")
 
     # strip column names
@@ -83,6 +103,7 @@ def load_fuel_factors():
     Accepts either 'kg_co2_per_unit' OR 'co2_kg_per_unit' (common variants).
     Returns DataFrame with columns: ['fuel_type', 'unit', 'kg_co2_per_unit']
     """
+    import pandas as pd
     df = _read_xlsx("fuel_emission_factors_worldwide.xlsx")
     df.rename(columns={c: c.strip() for c in df.columns}, inplace=True)
 
@@ -129,6 +150,7 @@ def load_category_consumption():
     Optional columns: unit
     Returns DataFrame: ['country_code', 'vehicle_category', 'fuel_type', 'consumption_per_km', 'unit']
     """
+    import pandas as pd
     df = _read_xlsx("Fuelconsumption_countrywise_vehiclewise.xlsx")
     df.rename(columns={c: c.strip() for c in df.columns}, inplace=True)
 
@@ -156,6 +178,91 @@ def load_category_consumption():
     return df[["country_code", "vehicle_category", "fuel_type", "consumption_per_km", "unit"]]
 
 
+# ------------------------------------------------------------------
+# Binary snapshot of the normalized tables
+# ------------------------------------------------------------------
+# Parsing the .xlsx files through openpyxl is the slowest part of worker start.
+# The normalized DataFrames are pickled once, keyed by a hash of the source
+# files, and reused until any of the spreadsheets changes.
+
+def source_digest() -> str:
+    """sha256 over the source spreadsheets (+ snapshot format and pandas version)."""
+    import pandas as pd
+    h = hashlib.sha256(f"v{SNAPSHOT_FORMAT}:pandas-{pd.__version__}".encode())
+    for name in SOURCE_FILES:
+        path = DATA_DIR / name
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found. Place your Excel file there.")
+        h.update(name.encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+def source_stamp() -> tuple:
+    """Cheap (mtime, size) signature of the source files, used to poll for changes."""
+    stamp = []
+    for name in SOURCE_FILES:
+        try:
+            st = (DATA_DIR / name).stat()
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append((name, None, None))
+    return tuple(stamp)
+
+def _snapshot_path(digest: str) -> Path:
+    return SNAPSHOT_DIR / f"tables-{digest[:16]}.pkl"
+
+def _write_snapshot(path: Path, tables: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)  # atomic, so concurrent workers never read a partial file
+    # drop snapshots of older source versions
+    for old in path.parent.glob("tables-*.pkl"):
+        if old != path:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+def load_all_tables():
+    """
+    Returns (grid_df, fuel_df, cat_df, digest), reading the pickled snapshot
+    when the source spreadsheets are unchanged and re-parsing (then refreshing
+    the snapshot) otherwise. Set TABLE_SNAPSHOT=0 to always parse the .xlsx files.
+    """
+    start = time.perf_counter()
+    digest = source_digest()
+    path = _snapshot_path(digest)
+
+    if SNAPSHOT_ENABLED and path.exists():
+        try:
+            with open(path, "rb") as f:
+                tables = pickle.load(f)
+            logger.info("emission tables loaded from snapshot %s in %.1f ms",
+                        path.name, (time.perf_counter() - start) * 1000)
+            return tables["grid"], tables["fuel"], tables["cat"], digest
+        except Exception as e:
+            logger.warning("ignoring unreadable table snapshot %s: %r", path, e)
+
+    tables = {
+        "grid": load_grid_factors(),
+        "fuel": load_fuel_factors(),
+        "cat": load_category_consumption(),
+    }
+    parsed_ms = (time.perf_counter() - start) * 1000
+
+    if SNAPSHOT_ENABLED:
+        try:
+            _write_snapshot(path, tables)
+        except OSError as e:
+            logger.warning("could not write table snapshot %s: %r", path, e)
+
+    logger.info("emission tables parsed from xlsx in %.1f ms (snapshot %s)",
+                parsed_ms, path.name if SNAPSHOT_ENABLED else "disabled")
+    return tables["grid"], tables["fuel"], tables["cat"], digest
+
+
 
 
 
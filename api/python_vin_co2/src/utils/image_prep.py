@@ -0,0 +1,88 @@
+# src/utils/image_prep.py
+"""
+Shrink VIN photos before OCR: grayscale, downscale, crop to the band of rows
+with the most edge contrast (where the VIN text is) and re-encode as JPEG.
+
+Pillow is optional: without it images are passed through unchanged.
+"""
+import io
+import os
+from typing import Tuple
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # pre-processing is skipped without Pillow
+    Image = None
+
+VIN_IMAGE_MAX_SIDE = int(os.getenv("VIN_IMAGE_MAX_SIDE", "1600"))
+VIN_IMAGE_QUALITY = int(os.getenv("VIN_IMAGE_QUALITY", "80"))
+VIN_IMAGE_CROP = os.getenv("VIN_IMAGE_CROP", "1") != "0"
+
+# a row belongs to the text band when its edge energy is >= this share of the peak row
+_BAND_THRESHOLD = 0.35
+# rows added above/below the detected band, as a share of the image height
+_BAND_MARGIN = 0.04
+
+
+def _text_band(gray) -> Tuple[int, int]:
+    """(top, bottom) rows of the strongest high-contrast horizontal band."""
+    w, h = gray.size
+    edges = gray.filter(ImageFilter.FIND_EDGES)
+    # averaging every row down to one pixel gives the per-row edge energy cheaply
+    energy = list(edges.resize((1, h), Image.BOX).getdata())
+    if not energy:
+        return 0, h
+    # smooth over a few rows so single noisy lines don't split the band
+    k = max(1, h // 100)
+    smoothed = [sum(energy[max(0, i - k):i + k + 1]) / len(energy[max(0, i - k):i + k + 1]) for i in range(h)]
+    peak_row = max(range(h), key=smoothed.__getitem__)
+    cutoff = smoothed[peak_row] * _BAND_THRESHOLD
+    if smoothed[peak_row] <= 0:
+        return 0, h
+
+    top = peak_row
+    while top > 0 and smoothed[top - 1] >= cutoff:
+        top -= 1
+    bottom = peak_row
+    while bottom < h - 1 and smoothed[bottom + 1] >= cutoff:
+        bottom += 1
+
+    margin = int(h * _BAND_MARGIN)
+    return max(0, top - margin), min(h, bottom + margin + 1)
+
+
+def prepare_vin_image(image_bytes: bytes, mime_type: str = "image/jpeg") -> Tuple[bytes, str]:
+    """
+    Returns (bytes, mime_type) to send to OCR. Falls back to the original
+    image when Pillow is missing, the image can't be decoded, or the result
+    would not be smaller.
+    """
+    if Image is None or not image_bytes:
+        return image_bytes, mime_type
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.format == "JPEG":
+            # let the JPEG decoder downscale (DCT scaling) and skip chroma: far cheaper than a full decode
+            img.draft("L", (VIN_IMAGE_MAX_SIDE, VIN_IMAGE_MAX_SIDE))
+        img = ImageOps.exif_transpose(img)
+        gray = img.convert("L")
+
+        if max(gray.size) > VIN_IMAGE_MAX_SIDE:
+            gray.thumbnail((VIN_IMAGE_MAX_SIDE, VIN_IMAGE_MAX_SIDE), Image.BILINEAR)
+
+        if VIN_IMAGE_CROP:
+            top, bottom = _text_band(gray)
+            # only crop when the band is a real strip, not (almost) the whole image
+            if 0 < bottom - top < gray.size[1] * 0.9:
+                gray = gray.crop((0, top, gray.size[0], bottom))
+
+        out = io.BytesIO()
+        gray.save(out, format="JPEG", quality=VIN_IMAGE_QUALITY, optimize=True)
+        data = out.getvalue()
+    except Exception as e:
+        print("Warning: VIN image pre-processing failed, sending original:", repr(e))
+        return image_bytes, mime_type
+
+    if len(data) >= len(image_bytes):
+        return image_bytes, mime_type
+    return data, "image/jpeg"